@@ -15,11 +15,17 @@ from sklearn.mixture import GaussianMixture
 from scipy.stats import boxcox
 import time
 import os
+from collections import deque
+from functools import partial
+import multiprocessing as mp
 from matplotlib.dates import date2num
 from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 import numpy as np
 from sklearn.cluster import DBSCAN
 
+from ragged import RaggedBeams
+
 #class Algorithm(object):
 #    """
 #    Superclass for algorithms.
@@ -106,6 +112,48 @@ from sklearn.cluster import DBSCAN
 #            scan_num / self.params["scan_eps"]))
 #        return data
 
+def _gbdb_chunk(task, neighbors, pts_ratio, scan_eps):
+    """
+    Core test and core components of one time chunk of the grid-based DBSCAN (runs in a worker)
+    task: (a, b, lo, occ, data_i), own scans a to b-1, occ holds the occupancy [scan, cell] of
+          the scans lo to lo+len(occ)-1, i.e. the chunk with a scan_eps halo on each side,
+          data_i the echo cells of the own scans
+    Returns the core flags [b-a, ncell], the local core component of each core cell (-1 for
+    the others), the number of components and, for each core cell, its region query as
+    edges (src scan, src cell, dst scan, dst cell) in global scan indices.
+    """
+    a, b, lo, occ, data_i = task
+    ncell = occ.shape[1]
+    core = np.zeros((b - a, ncell), dtype=bool)
+    edges = []
+    for s in range(a, b):
+        s_min, s_max = max(0, s - lo - scan_eps), min(len(occ), s - lo + scan_eps + 1)
+        cells = np.unique(data_i[s - a])
+        if len(cells) == 0: continue
+        nb = [neighbors[x] for x in cells]
+        n_nb = np.array([len(x) for x in nb])
+        counts = occ[s_min:s_max][:, np.concatenate(nb)].sum(axis=0, dtype=np.int64)
+        counts = np.add.reduceat(counts, np.r_[0, np.cumsum(n_nb)[:-1]])
+        is_core = counts >= n_nb * (s_max - s_min) * pts_ratio
+        core[s - a, cells[is_core]] = True
+        for x in cells[is_core]:
+            idx = neighbors[x]
+            cell, ds = np.nonzero(occ[s_min:s_max, idx].T)
+            edges.append(np.stack([np.full(len(cell), s), np.full(len(cell), x), ds + s_min + lo, idx[cell]]))
+    edges = np.concatenate(edges, axis=1) if len(edges) > 0 else np.zeros((4, 0), dtype=int)
+    # Components of the cores linked by edges within the chunk
+    node = -np.ones((b - a, ncell), dtype=np.int64)
+    ncore = int(core.sum())
+    node[core] = np.arange(ncore)
+    own = (edges[2] >= a) & (edges[2] < b)
+    src, dst = edges[:, own][:2], edges[:, own][2:]
+    keep = core[dst[0] - a, dst[1]]
+    graph = sparse.coo_matrix((np.ones(int(keep.sum())), (node[src[0][keep] - a, src[1][keep]],
+        node[dst[0][keep] - a, dst[1][keep]])), shape=(ncore, ncore))
+    ncomp, comp = connected_components(graph, directed=False)
+    node[core] = comp
+    return core, node, ncomp, edges.astype(np.int32)
+
 class GridBasedDBAlgorithm():
     """
     Grid-based DBSCAN
@@ -142,24 +190,147 @@ class GridBasedDBAlgorithm():
             for beam in range(nbeam):
                 self.C[gate, beam] = self._calculate_ratio(self.params["dr"], dtheta, gate, beam,
                         r_init=self.params["r_init"])
+        self._build_stencils()
+        return
+
+    def _build_stencils(self):
+        """
+        Precompute the ellipse neighborhood of every cell. The ellipse only depends on the cell
+        through self.C (in practice on the gate), so one stencil of (gate, beam) offsets is built
+        per distinct C value; self.neighbors[gate*nbeam + beam] holds the flat indices of the
+        in-grid cells of the stencil around (gate, beam), in gate then beam order.
+        """
+        nrang, nbeam = self.C.shape
+        hgt = self.params["g"]
+        stencils = {}
+        self.neighbors = []
+        for gate in range(nrang):
+            for beam in range(nbeam):
+                c = self.C[gate, beam]
+                if c not in stencils:
+                    wid = self.params["g"] / (self.params["f"] * c)
+                    ciel_hgt, ciel_wid = int(np.ceil(hgt)), int(np.ceil(wid))
+                    dg, db = np.meshgrid(np.arange(-ciel_hgt, ciel_hgt + 1), np.arange(-ciel_wid, ciel_wid + 1),
+                            indexing="ij")
+                    dg, db = dg.ravel(), db.ravel()
+                    inside = (dg**2.0 / hgt**2.0 + db**2.0 / wid**2.0) <= 1.0
+                    stencils[c] = (dg[inside], db[inside])
+                dg, db = stencils[c]
+                g, b = gate + dg, beam + db
+                ok = (g >= 0) & (g < nrang) & (b >= 0) & (b < nbeam)
+                self.neighbors.append(g[ok] * nbeam + b[ok])
         return
 
     def _gbdb(self, data, data_i):
+        """
+        Label the echoes of the occupancy cube data [nscan, nrang, nbeam], data_i holds the flat
+        cells of the echoes of each scan; labels are kept in an int32 cube of the same shape
+        """
         t0 = time.time()
         cluster_id = 1
         clust_flgs = []
         nscans = len(data)
-        grid_labels = [np.zeros(data[0].shape).astype(int) for i in range(nscans)]
+        occ = data.reshape(nscans, -1)
+        labels = np.zeros(data.shape, dtype=np.int32)
+        grid_labels = labels.reshape(nscans, -1)
         for scan_i in range(nscans):
             m_i = data_i[scan_i]
             for grid_id in m_i:
-                if grid_labels[scan_i][grid_id] == self.UNCLASSIFIED:
-                    if self._expand_cluster(data, grid_labels, scan_i, grid_id, cluster_id):
+                if grid_labels[scan_i, grid_id] == self.UNCLASSIFIED:
+                    if self._expand_cluster(occ, grid_labels, scan_i, grid_id, cluster_id):
                         cluster_id = cluster_id + 1
-            scan_pt_labels = [grid_labels[scan_i][grid_id] for grid_id in m_i]
-            clust_flgs.extend(scan_pt_labels)
+            clust_flgs.append(grid_labels[scan_i, m_i])
+        clust_flgs = np.concatenate(clust_flgs) if nscans > 0 else np.zeros(0, dtype=np.int32)
+        runtime = time.time() - t0
+        return clust_flgs, runtime
+
+    def _is_symmetric(self):
+        """
+        True if the neighborhoods are symmetric (q is a neighbor of p iff p is a neighbor of q),
+        e.g. always with g = 1
+        """
+        ncell = len(self.neighbors)
+        p = np.repeat(np.arange(ncell), [len(x) for x in self.neighbors])
+        q = np.concatenate(self.neighbors)
+        return bool(np.isin(q * ncell + p, p * ncell + q).all())
+
+    def _gbdb_parallel(self, data, data_i, n_procs=4):
+        """
+        Time chunked _gbdb, same labels as the single process run.
+        The scans are split in n_procs chunks that overlap by scan_eps, each chunk runs the core
+        tests and region queries of its scans in a worker process and labels its core components
+        (see _gbdb_chunk). Components linked across the chunk boundaries, i.e. through the cells of
+        the scan_eps scans the chunks share, are merged with a union-find. Clusters and borders
+        are then numbered and assigned in the order of the single process expansion: cluster IDs
+        by first core in (scan, echo) order, a border cell takes the last cluster whose first
+        core has it as neighbor, else the first cluster reaching it; labels of a scan only see
+        the clusters started up to that scan.
+        The replay of the expansion order relies on symmetric neighborhoods, the single process
+        run is used otherwise.
+        """
+        nscans = len(data)
+        if n_procs <= 1 or nscans < 2 or not self._is_symmetric(): return self._gbdb(data, data_i)
+        t0 = time.time()
+        eps = self.params["scan_eps"]
+        occ = data.reshape(nscans, -1)
+        ncell = occ.shape[1]
+        bounds = np.linspace(0, nscans, min(n_procs, nscans) + 1).astype(int)
+        tasks = [(a, b, max(0, a - eps), occ[max(0, a - eps):min(nscans, b + eps)], data_i[a:b])
+                for a, b in zip(bounds[:-1], bounds[1:])]
+        func = partial(_gbdb_chunk, neighbors=self.neighbors, pts_ratio=self.params["pts_ratio"], scan_eps=eps)
+        with mp.Pool(len(tasks)) as pool:
+            out = pool.map(func, tasks)
+        core = np.concatenate([o[0] for o in out])
+        offsets = np.r_[0, np.cumsum([o[2] for o in out])]
+        comp = np.concatenate([np.where(o[1] >= 0, o[1] + off, -1) for o, off in zip(out, offsets)])
+        src_s, src_c, dst_s, dst_c = [x.astype(np.int64) for x in np.concatenate([o[3] for o in out], axis=1)]
+        # Merge the components linked by a core to core edge across chunks
+        parent = np.arange(offsets[-1])
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        dst_core = core[dst_s, dst_c]
+        c1, c2 = comp[src_s[dst_core], src_c[dst_core]], comp[dst_s[dst_core], dst_c[dst_core]]
+        for x, y in np.unique(np.stack([c1[c1 != c2], c2[c1 != c2]]), axis=1).T:
+            x, y = find(x), find(y)
+            if x != y: parent[max(x, y)] = min(x, y)
+        root = np.array([find(x) for x in range(offsets[-1])], dtype=np.int64)
+        # Cluster IDs in the order of the first core of each component
+        n = [len(m_i) for m_i in data_i]
+        ps, pc = np.repeat(np.arange(nscans), n), np.concatenate(data_i)
+        pi = np.flatnonzero(core[ps, pc])
+        r, first = np.unique(root[comp[ps[pi], pc[pi]]], return_index=True)
+        order = np.argsort(first)
+        cl = np.zeros(offsets[-1] + 1, dtype=np.int64)
+        cl[r[order]] = np.arange(1, len(r) + 1)
+        start_s = np.r_[-1, ps[pi[first[order]]]]
+        start_c = np.r_[-1, pc[pi[first[order]]]]
+        labels = np.zeros((nscans, ncell), dtype=np.int32)
+        labels[core] = cl[root[comp[core]]]
+        # Border cells: last cluster seeded from its first core, else first cluster reaching the cell
+        k = cl[root[comp[src_s, src_c]]]
+        ok = ~dst_core & (start_s[k] <= dst_s)
+        seed = ok & (src_s == start_s[k]) & (src_c == start_c[k])
+        d = dst_s * ncell + dst_c
+        last_seed = np.zeros(nscans * ncell, dtype=np.int64)
+        np.maximum.at(last_seed, d[seed], k[seed])
+        first_reach = np.full(nscans * ncell, len(r) + 1, dtype=np.int64)
+        np.minimum.at(first_reach, d[ok], k[ok])
+        border = np.where(last_seed > 0, last_seed, np.where(first_reach <= len(r), first_reach, self.NOISE))
+        labels[~core] = border.reshape(nscans, ncell)[~core]
+        clust_flgs = labels[ps, pc]
         runtime = time.time() - t0
-        return np.array(clust_flgs), runtime
+        return clust_flgs, runtime
+
+    def _1D_to_scanxscan(self, array):
+        """
+        Split a 1D array of one value per echo into a list of per scan arrays (views), the
+        layout of self.data_dict
+        """
+        n = [len(s) for s in self.data_dict["slist"]]
+        return np.split(array, np.cumsum(n)[:-1]) if len(n) > 0 else []
 
     def _in_ellipse(self, p, q, hgt, wid):
         return ((q[0] - p[0])**2.0 / hgt**2.0 + (q[1] - p[1])**2.0 / wid**2.0) <= 1.0
@@ -176,70 +347,64 @@ class GridBasedDBAlgorithm():
         return cij
 
     def _get_gbdb_data_matrix(self, data_dict):
-        gate = data_dict["slist"]
-        beam = data_dict["bmnum"]
-        values = [[True]*len(s) for s in beam]
+        """
+        Occupancy cube [nscan, nrang, nbeam] (int8, 1 where there is an echo, nscan*nrang*nbeam
+        bytes) and, for each scan, the flat cell index gate*nbeam + beam of its echoes in data order
+        """
         ngate = int(self.params["nrang"])
         nbeam = int(self.params["nbeam"])
-        nscan = len(beam)
-        data = []
-        data_i = []
-        for i in range(nscan):
-            m = sparse.csr_matrix((values[i], (gate[i], beam[i])), shape=(ngate, nbeam))
-            m_i = list(zip(np.array(gate[i]).astype(int), np.array(beam[i]).astype(int)))
-            data.append(m)
-            data_i.append(m_i)
+        nscan = len(data_dict["bmnum"])
+        n = [len(b) for b in data_dict["bmnum"]]
+        gate = np.concatenate(data_dict["slist"]).astype(int) if nscan > 0 else np.zeros(0, dtype=int)
+        beam = np.concatenate(data_dict["bmnum"]).astype(int) if nscan > 0 else np.zeros(0, dtype=int)
+        cells = gate * nbeam + beam
+        data = np.zeros((nscan, ngate, nbeam), dtype=np.int8)
+        data.reshape(nscan, -1)[np.repeat(np.arange(nscan), n), cells] = 1
+        data_i = np.split(cells, np.cumsum(n)[:-1]) if nscan > 0 else []
         return data, data_i
 
     def _expand_cluster(self, data, grid_labels, scan_i, grid_id, cluster_id):
+        """
+        Grow a cluster from a core cell as a breadth first search: the frontier is a FIFO queue
+        (deque) so each cell is queued and queried at most once and the expansion is linear in the
+        cluster size, cells are visited in the same order as with the original seed list
+        """
         seeds, possible_pts = self._region_query(data, scan_i, grid_id)
         k = possible_pts * self.params["pts_ratio"]
         if len(seeds) < k:
-            grid_labels[scan_i][grid_id] = self.NOISE
+            grid_labels[scan_i, grid_id] = self.NOISE
             return False
         else:
-            grid_labels[scan_i][grid_id] = cluster_id
-            for seed_id in seeds:
-                grid_labels[seed_id[0]][seed_id[1]] = cluster_id
+            grid_labels[scan_i, grid_id] = cluster_id
+            for seed_scan, seed_grid in seeds:
+                grid_labels[seed_scan, seed_grid] = cluster_id
+            seeds = deque(seeds)
             while len(seeds) > 0:
-                current_scan, current_grid = seeds[0][0], seeds[0][1]
+                current_scan, current_grid = seeds.popleft()
                 results, possible_pts = self._region_query(data, current_scan, current_grid)
                 k = possible_pts * self.params["pts_ratio"]
                 if len(results) >= k:
-                    for i in range(0, len(results)):
-                        result_scan, result_point = results[i][0], results[i][1]
-                        if grid_labels[result_scan][result_point] == self.UNCLASSIFIED \
-                                or grid_labels[result_scan][result_point] == self.NOISE:
-                            if grid_labels[result_scan][result_point] == self.UNCLASSIFIED:
+                    for result_scan, result_point in results:
+                        label = grid_labels[result_scan, result_point]
+                        if label == self.UNCLASSIFIED or label == self.NOISE:
+                            if label == self.UNCLASSIFIED:
                                 seeds.append((result_scan, result_point))
-                            grid_labels[result_scan][result_point] = cluster_id
-                seeds = seeds[1:]
+                            grid_labels[result_scan, result_point] = cluster_id
             return True
 
     def _region_query(self, data, scan_i, grid_id):
-        seeds = []
-        hgt = self.params["g"]
-        wid = self.params["g"] / (self.params["f"] * self.C[grid_id[0], grid_id[1]])
-        ciel_hgt = int(np.ceil(hgt))
-        ciel_wid = int(np.ceil(wid))
-        
-        # Check for neighbors in a box of shape ciel(2*wid), ciel(2*hgt) around the point
-        g_min = max(0, grid_id[0] - ciel_hgt)     # gate box
-        g_max = min(int(self.data_dict["nrang"]), grid_id[0] + ciel_hgt + 1)
-        b_min = max(0, grid_id[1] - ciel_wid)     # beam box
-        b_max = min(int(self.data_dict["nbeam"]), grid_id[1] + ciel_wid + 1)
+        """
+        Neighbors of a cell within its ellipse and the scan_eps time filter, gathered in one
+        vectorized lookup of the precomputed stencil into the occupancy data [nscan, nrang*nbeam].
+        grid_id: flat cell index gate*nbeam + beam
+        Returns the seeds [(scan, cell)] and the number of cells searched (possible_pts).
+        """
+        idx = self.neighbors[grid_id]
         s_min = max(0, scan_i - self.params["scan_eps"])  # scan box
         s_max = min(len(data), scan_i + self.params["scan_eps"]+1)
-        possible_pts = 0
-        for g in range(g_min, g_max):
-            for b in range(b_min, b_max):
-                new_id = (g, b)
-                # Add the new point only if it falls within the ellipse defined by wid, hgt
-                for s in range(s_min, s_max):   # time filter
-                    if self._in_ellipse(new_id, grid_id, hgt, wid):
-                        possible_pts += 1
-                        if data[s][new_id]:   # Add the point to seeds only if there is a 1 in the sparse matrix there
-                            seeds.append((s, new_id))
+        cell, s = np.nonzero(data[s_min:s_max, idx].T)
+        seeds = list(zip(s + s_min, idx[cell]))
+        possible_pts = len(idx) * (s_max - s_min)
         return seeds, possible_pts
 
 
@@ -248,7 +413,12 @@ class GridBasedDBSCAN(GridBasedDBAlgorithm):
     def __init__(self, start_time, end_time, rad, nbeam, nrang, rec,
             f=0.2, g=1, pts_ratio=0.3,
             dr=45, dtheta=3.24, r_init=180,
-            scan_eps=1):
+            scan_eps=1, n_procs=1):
+        """
+        rec: RaggedBeams or dataframe with time, bmnum, scan_id (scan index of each beam, see
+             RaggedBeams.to_frame: the scan flag alone is lost with the beams without echoes) and slist
+        n_procs: number of worker processes, the scans are clustered in time chunks with n_procs > 1
+        """
         super().__init__(start_time, end_time, rad,
                 {"f": f,
                     "g": g,
@@ -259,7 +429,202 @@ class GridBasedDBSCAN(GridBasedDBAlgorithm):
                     "r_init": r_init,
                     "nbeam": nbeam,
                     "nrang": nrang})
-        self.data_dict = rec.to_dict("list")
+        if not isinstance(rec, RaggedBeams):
+            if "scan_id" not in rec.columns: raise ValueError("rec needs a scan_id column to split the scans")
+            rec = RaggedBeams.from_frame(rec[["time", "bmnum", "scan_id", "slist"]], ["slist"])
+        elif ("scan" not in rec.beams) and (rec._scan_offsets is None):
+            raise ValueError("rec needs a scan parameter to split the scans")
+        self.data_dict = rec.scan_dict(["slist", "bmnum", "time"])
         data, data_i = self._get_gbdb_data_matrix(self.data_dict)
-        #clust_flg, self.runtime = self._gbdb(data, data_i)
-        #self.clust_flg = self._1D_to_scanxscan(clust_flg)
+        if n_procs > 1: clust_flg, self.runtime = self._gbdb_parallel(data, data_i, n_procs)
+        else: clust_flg, self.runtime = self._gbdb(data, data_i)
+        self.clust_flg = self._1D_to_scanxscan(clust_flg)
+
+
+class GridBasedDBSCANStream(GridBasedDBAlgorithm):
+    """
+    Streaming grid-based DBSCAN for near real time use (e.g. on the scans of FitacfFollower).
+    Scans are pushed one at a time into a ring buffer of the last 2*scan_eps+1 scan grids
+    (occupancy, core flag and label of every cell), so memory is constant and each push costs
+    the labelling of one scan:
+        - when scan n arrives, the time window of scan n-scan_eps is complete and its cells are
+          classified with the same core test as GridBasedDBSCAN;
+        - its core cells are linked to the core cells of the same scan and of the scan_eps
+          previous scans in both neighborhood directions, a group of linked cores keeps the
+          oldest cluster ID it touches (clusters that merge take the older ID in the buffer)
+          or gets a new one;
+        - the non core cells in the neighborhood of the new cores become border cells of
+          their clusters, the remaining non core cells of the scan are noise;
+        - scan n-2*scan_eps is final and is returned.
+    Labels of a scan are thus returned 2*scan_eps scans after it arrives, cluster IDs are
+    carried forward from scan to scan. Clusters are the connected core cells (DBSCAN), the
+    batch GridBasedDBSCAN labels the cells in its own expansion order instead, so border cells
+    and clusters merging late may be labelled differently.
+    """
+
+    def __init__(self, rad, nbeam, nrang,
+            f=0.2, g=1, pts_ratio=0.3,
+            dr=45, dtheta=3.24, r_init=180,
+            scan_eps=1):
+        super().__init__(None, None, rad,
+                {"f": f,
+                    "g": g,
+                    "pts_ratio": pts_ratio,
+                    "scan_eps": scan_eps,
+                    "dr": dr,
+                    "dtheta": dtheta,
+                    "r_init": r_init,
+                    "nbeam": nbeam,
+                    "nrang": nrang})
+        ncell = int(nrang) * int(nbeam)
+        # Cells linked to a cell in either direction: its neighbors and the cells it is a neighbor of
+        p = np.repeat(np.arange(ncell), [len(x) for x in self.neighbors])
+        q = np.concatenate(self.neighbors)
+        o = np.argsort(q, kind="stable")
+        rneighbors = np.split(p[o], np.cumsum(np.bincount(q, minlength=ncell))[:-1])
+        self.adjacent = [np.union1d(x, y) for x, y in zip(self.neighbors, rneighbors)]
+        self.nslot = 2 * scan_eps + 1
+        self.occ = np.zeros((self.nslot, ncell), dtype=np.int8)
+        self.core = np.zeros((self.nslot, ncell), dtype=bool)
+        self.labels = np.zeros((self.nslot, ncell), dtype=np.int32)
+        self.cells = [None] * self.nslot
+        self.keys = [None] * self.nslot
+        self.nscan, self.nclassified, self.nemitted = 0, 0, 0
+        self.cluster_id = 1
+        self.runtime = 0.
+        return
+
+    def push(self, gates, beams, key=None):
+        """
+        Add the next scan and return the scans whose labels became final, as a list of
+        (key, labels) with one label per echo of the scan (NOISE = -1)
+        gates: range gate of each echo of the scan
+        beams: beam number of each echo
+        key: returned with the labels of the scan, e.g. its time
+        """
+        t0 = time.time()
+        n, slot = self.nscan, self.nscan % self.nslot
+        cells = np.asarray(gates).astype(int) * int(self.params["nbeam"]) + np.asarray(beams).astype(int)
+        self.occ[slot], self.core[slot], self.labels[slot] = 0, False, self.UNCLASSIFIED
+        self.occ[slot, cells] = 1
+        self.cells[slot], self.keys[slot] = cells, key
+        self.nscan += 1
+        if n - self.params["scan_eps"] >= 0: self._classify(n - self.params["scan_eps"])
+        out = self._emit(n - 2 * self.params["scan_eps"])
+        self.runtime += time.time() - t0
+        return out
+
+    def push_scan(self, sc):
+        """
+        Add the next Scan (see get_sd_data.Scan), returns the (Scan, labels) of the final scans
+        """
+        if sc.ragged is not None:
+            gates, beams = sc.ragged.gate_column("slist"), sc.ragged.gate_column("bmnum")
+        else:
+            gates = np.concatenate([np.asarray(b.slist) for b in sc.beams] + [np.zeros(0, dtype=int)])
+            beams = np.concatenate([np.full(len(b.slist), b.bmnum) for b in sc.beams] + [np.zeros(0, dtype=int)])
+        return self.push(gates, beams, sc)
+
+    def flush(self):
+        """
+        End of the stream: classify the last scans with the scans available (as the batch run
+        does at the end of the interval) and return the remaining (key, labels)
+        """
+        t0 = time.time()
+        for c in range(self.nclassified, self.nscan):
+            self._classify(c)
+        out = self._emit(self.nscan - 1)
+        self.nscan, self.nclassified, self.nemitted = 0, 0, 0
+        self.occ[:], self.core[:], self.labels[:] = 0, False, self.UNCLASSIFIED
+        self.runtime += time.time() - t0
+        return out
+
+    def stream(self, scans):
+        """
+        Label an iterable of Scans (e.g. FitacfFollower.follow()), yields (Scan, labels) as they become final
+        """
+        for sc in scans:
+            for o in self.push_scan(sc):
+                yield o
+        for o in self.flush():
+            yield o
+        return
+
+    def _emit(self, upto):
+        """
+        Labels of the scans up to index upto, in order
+        """
+        out = []
+        while self.nemitted <= upto:
+            slot = self.nemitted % self.nslot
+            out.append((self.keys[slot], self.labels[slot, self.cells[slot]].copy()))
+            self.cells[slot], self.keys[slot] = None, None
+            self.nemitted += 1
+        return out
+
+    def _classify(self, c):
+        """
+        Core test, cluster linking and border cells of scan c, all the scans of its time window are in the buffer
+        """
+        eps = self.params["scan_eps"]
+        s_min, s_max = max(0, c - eps), min(self.nscan, c + eps + 1)
+        rows = np.arange(s_min, s_max) % self.nslot
+        slot = c % self.nslot
+        earlier = rows[:c - s_min]
+        self.nclassified = c + 1
+        cells = self.cells[slot]
+        _, first = np.unique(cells, return_index=True)
+        cells = cells[np.sort(first)]
+        if len(cells) == 0: return
+        # Core test of all the cells of the scan in one gather
+        nb = [self.neighbors[x] for x in cells]
+        n_nb = np.array([len(x) for x in nb])
+        counts = self.occ[rows][:, np.concatenate(nb)].sum(axis=0, dtype=np.int64)
+        counts = np.add.reduceat(counts, np.r_[0, np.cumsum(n_nb)[:-1]])
+        is_core = counts >= n_nb * (s_max - s_min) * self.params["pts_ratio"]
+        cores = cells[is_core]
+        self.core[slot, cores] = True
+        # Union-find over the new cores and the clusters of the linked older cores
+        parent = {}
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+        def union(x, y):
+            x, y = find(x), find(y)
+            if x != y: parent[max(x, y)] = min(x, y)
+            return
+        core_e, labels_e = self.core[earlier], self.labels[earlier]
+        for p in cores:
+            adj = self.adjacent[p]
+            node = ("c", p)
+            find(node)
+            for q in adj[self.core[slot, adj]]:
+                union(node, ("c", q))
+            for lid in np.unique(labels_e[:, adj][core_e[:, adj]]):
+                union(node, ("l", int(lid)))
+        groups = {}
+        for x in list(parent.keys()):
+            groups.setdefault(find(x), []).append(x)
+        order = dict((("c", p), i) for i, p in enumerate(cores))
+        for root in sorted(groups.keys(), key=lambda r: min(order.get(x, len(order)) for x in groups[r])):
+            members = [x[1] for x in groups[root] if x[0] == "c"]
+            old = sorted(x[1] for x in groups[root] if x[0] == "l")
+            if len(members) == 0: continue
+            if len(old) == 0:
+                lid = self.cluster_id
+                self.cluster_id += 1
+            else:
+                lid = old[0]
+                if len(old) > 1: self.labels[np.isin(self.labels, old[1:])] = lid
+            self.labels[slot, members] = lid
+        # Border cells of the new cores, then noise
+        for p in cores:
+            lid, idx = self.labels[slot, p], self.neighbors[p]
+            border = (self.occ[rows][:, idx] == 1) & ~self.core[rows][:, idx] & (self.labels[rows][:, idx] <= 0)
+            r, i = np.nonzero(border)
+            self.labels[rows[r], idx[i]] = lid
+        noise = cells[~is_core]
+        self.labels[slot, noise[self.labels[slot, noise] <= 0]] = self.NOISE
+        return
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""benchmark.py: module is dedicated to measure the run time and memory of the data pipeline."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import argparse
+import time
+import tracemalloc
+
+def measure(func, *args, **kwargs):
+    """
+    Run a function and return its output, run time [s] and peak traced memory [MB]
+    func: function to measure
+    """
+    tracemalloc.start()
+    t0 = time.time()
+    o = func(*args, **kwargs)
+    runtime = time.time() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return o, runtime, peak / 1024.**2
+
+def bench_projection(fname, columns=["bmnum", "noise.sky", "tfreq", "v", "p_l", "w_l", "slist", "elv"]):
+    """
+    Compare parsing all the parameters of a fitacf file against parsing only the requested columns
+    fname: fitacf.bz2 file name
+    columns: projected columns
+    """
+    from get_sd_data import _read_fitacf
+    full, t_full, m_full = measure(_read_fitacf, fname)
+    proj, t_proj, m_proj = measure(_read_fitacf, fname, None, columns)
+    print(" Records - ", len(full))
+    print(" All parameters       : %.3f s, %.1f MB" % (t_full, m_full))
+    print(" Projected parameters : %.3f s, %.1f MB" % (t_proj, m_proj))
+    return
+
+class _DictBeam(object):
+    """Beam holding its parameters in a __dict__, reference for bench_beams"""
+
+    def set(self, time, d, s_params, v_params, gs=False):
+        self.time = time
+        for p in s_params: setattr(self, p, d.get(p))
+        for p in v_params: setattr(self, p, d.get(p, []))
+        return
+
+def bench_beams(fname, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang"],
+        v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"]):
+    """
+    Per object memory and construction time of the slotted beams against beams holding a __dict__,
+    the arrays of the records are shared so only the objects themselves are measured
+    fname: fitacf.bz2 file name
+    """
+    from get_sd_data import _read_fitacf, _record_time, Beam
+    data = _read_fitacf(fname, None, s_params + v_params)
+    times = [_record_time(d) for d in data]
+    def build(cls):
+        o = []
+        for t, d in zip(times, data):
+            b = cls()
+            b.set(t, d, s_params, v_params, False)
+            o.append(b)
+        return o
+    print(" Beams - ", len(data))
+    for name, cls in [("__dict__", _DictBeam), ("__slots__", Beam)]:
+        _, runtime, peak = measure(build, cls)
+        print(" %-10s: %.2f us, %.0f B per beam" % (name, 1e6*runtime/len(data), 1024.**2*peak/len(data)))
+    return
+
+def _gbdb_band(nscan, nbeam=16, nrang=75, gates=(10, 40), fill=0.8, seed=0):
+    """
+    Synthetic scans holding one ground scatter like band over all the beams, with a fraction
+    fill of the cells of the band occupied, so the echo count and cluster size grow with nscan
+    """
+    import numpy as np
+    import pandas as pd
+    rng = np.random.RandomState(seed)
+    s, b, g = np.meshgrid(np.arange(nscan), np.arange(nbeam), np.arange(gates[0], gates[1]), indexing="ij")
+    keep = rng.rand(*s.shape) < fill
+    s, b, g = s[keep], b[keep], g[keep]
+    t = np.datetime64("2015-03-17T00:00:00") + (60 * s + 3 * b).astype("timedelta64[s]")
+    return pd.DataFrame({"time": t, "bmnum": b, "scan_id": s, "slist": g})
+
+def bench_gbdb(nscans=[10, 20, 40, 80], nbeam=16, nrang=75, n_procs=1):
+    """
+    Run time of the grid-based DBSCAN labelling (GridBasedDBSCAN.runtime) against the number
+    of echoes, the time per echo stays flat when the cluster expansion is linear
+    nscans: number of scans of each run
+    n_procs: number of worker processes (time chunked run if > 1)
+    """
+    import sys
+    sys.path.append("algorithms/")
+    from sdalgo import GridBasedDBSCAN
+    for nscan in nscans:
+        df = _gbdb_band(nscan, nbeam, nrang)
+        gbdb = GridBasedDBSCAN(None, None, None, nbeam, nrang, df, n_procs=n_procs)
+        print(" Scans - %4d, echoes - %7d: %.3f s, %.1f us per echo" % (nscan, len(df), gbdb.runtime,
+            1e6*gbdb.runtime/len(df)))
+    return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fname", default=None, help="fitacf.bz2 file used for the benchmark")
+    parser.add_argument("-np", "--n_procs", type=int, default=1, help="worker processes of the grid-based DBSCAN")
+    args = parser.parse_args()
+    if args.fname is not None:
+        bench_projection(args.fname)
+        bench_beams(args.fname)
+    bench_gbdb(n_procs=args.n_procs)
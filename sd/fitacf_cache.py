@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""fitacf_cache.py: module is dedicated to cache the parsed fitacf files on local disk."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import os
+import glob
+import hashlib
+import numpy as np
+
+class FitacfCache(object):
+    """
+    Size bounded LRU cache of parsed (columnar) fitacf files.
+    Each file is stored as an uncompressed .npz keyed by the file path, size, mtime
+    and the list of parameters, so a modified file or a new projection is a miss.
+    Entries are written in the RaggedBeams.to_arrays layout; bump version when it changes.
+    The mtime of a cache entry is bumped on every hit and used as the LRU clock.
+    """
+
+    version = "2"
+
+    def __init__(self, cache_dir="data/cache/", max_size=4*1024**3):
+        """
+        Initialize the cache
+        cache_dir: folder holding the cached files
+        max_size: maximum size of the cache folder in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return
+
+    def _path(self, fname, params):
+        """
+        Cache file name of a fitacf file
+        fname: fitacf file name
+        params: list of parameters stored
+        """
+        st = os.stat(fname)
+        key = "|".join([self.version, os.path.abspath(fname), str(st.st_size), str(st.st_mtime_ns)] + list(params))
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npz")
+
+    def get(self, fname, params):
+        """
+        Load the arrays of one file, returns None on a miss
+        fname: fitacf file name
+        params: list of parameters
+        """
+        path = self._path(fname, params)
+        try:
+            with np.load(path) as z:
+                cols = dict((k, z[k]) for k in z.files)
+            os.utime(path)
+        except (OSError, KeyError, ValueError): cols = None
+        return cols
+
+    def put(self, fname, params, cols):
+        """
+        Store the arrays of one file and evict the least recently used entries
+        fname: fitacf file name
+        params: list of parameters
+        cols: dict of arrays
+        """
+        path = self._path(fname, params)
+        tmp = path + ".%d.tmp" % os.getpid()
+        with open(tmp, "wb") as fp:
+            np.savez(fp, **cols)
+        os.replace(tmp, path)
+        self.evict()
+        return
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the folder fits in max_size
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            try:
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+            except OSError: pass
+        total = sum([e[1] for e in entries])
+        for _, size, path in sorted(entries):
+            if total <= self.max_size: break
+            try: os.remove(path)
+            except OSError: pass
+            total -= size
+        return
+
+    def clear(self):
+        """
+        Remove all the entries
+        """
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            os.remove(path)
+        return
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""fitacf_catalog.py: module is dedicated to index the fitacf archive by radar and time."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import os
+import glob
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+class FitacfCatalog(object):
+    """
+    Persistent catalog of the fitacf files of one radar (radar, start time, end time, path).
+    The catalog is stored as csv and updated incrementally: a year folder is only listed
+    again when its mtime changed (new or removed files) or when its newest file, the only
+    one still being written, changed size or mtime; all the known files are checked with
+    verify=True. Only new or modified files are added.
+
+    The start time is taken from the file name. Unless the file is probed (first and last
+    record read once), the end time is the start of the next file of the radar, which is
+    an upper bound whatever the file duration; the last file is bounded by one day.
+    """
+
+    root = "/sd-data/"
+    columns = ["rad", "stime", "etime", "path", "size", "mtime", "probed"]
+
+    def __init__(self, rad, catalog_dir="data/catalog/", probe=False):
+        """
+        Initialize the catalog
+        rad: radar code
+        catalog_dir: folder holding the catalog files
+        probe: read first/last record of new files to get their exact extent
+        """
+        self.rad = rad
+        self.probe = probe
+        self.catalog_dir = catalog_dir
+        self.fname = os.path.join(catalog_dir, "{rad}.fitacf.csv".format(rad=rad))
+        self.dname = os.path.join(catalog_dir, "{rad}.dirs.csv".format(rad=rad))
+        if os.path.exists(self.fname):
+            self.files = pd.read_csv(self.fname, parse_dates=["stime", "etime"])
+            self.dirs = pd.read_csv(self.dname)
+        else:
+            self.files = pd.DataFrame(columns=self.columns)
+            self.dirs = pd.DataFrame(columns=["dir", "mtime"])
+        return
+
+    def _file_start(self, path):
+        """
+        Start time of a file from its name, {date}.{HHMM}.{SS}.{rad}.fitacf.bz2
+        """
+        p = os.path.basename(path).split(".")
+        return dt.datetime.strptime(p[0] + p[1] + p[2], "%Y%m%d%H%M%S")
+
+    def _file_extent(self, path):
+        """
+        Time of first and last record of a file, None for an empty file
+        """
+        from get_sd_data import read_extent
+        return read_extent(path)
+
+    def _scan_dir(self, d):
+        """
+        List one year folder and return the rows of new or modified files
+        """
+        known = self.files[self.files.path.str.startswith(d)]
+        known = dict((r["path"], r) for r in known.to_dict("records"))
+        rows = []
+        for e in os.scandir(d):
+            if not e.name.endswith(".{rad}.fitacf.bz2".format(rad=self.rad)): continue
+            st = e.stat()
+            r = known.get(e.path)
+            if (r is not None) and (r["size"] == st.st_size) and (r["mtime"] == st.st_mtime_ns):
+                rows.append(r)
+                continue
+            stime, etime, probed = self._file_start(e.path), pd.NaT, False
+            if self.probe:
+                ext = self._file_extent(e.path)
+                if ext is not None: (stime, etime), probed = ext, True
+            rows.append({"rad": self.rad, "stime": stime, "etime": etime, "path": e.path,
+                "size": st.st_size, "mtime": st.st_mtime_ns, "probed": probed})
+        return rows
+
+    def _modified(self, d, verify=False):
+        """
+        True if the newest known file of a folder (all the known files if verify) was
+        modified or removed; archived files are not rewritten, so a single stat per folder
+        (a round trip on a network filesystem) is enough in the incremental case
+        """
+        known = self.files[self.files.path.str.startswith(d)]
+        if not verify: known = known.sort_values(by=["stime", "path"]).tail(1)
+        for path, size, mtime in zip(known["path"], known["size"], known["mtime"]):
+            try: st = os.stat(path)
+            except OSError: return True
+            if (st.st_size != size) or (st.st_mtime_ns != mtime): return True
+        return False
+
+    def update(self, years=None, force=False, verify=False):
+        """
+        Update the catalog incrementally and save it
+        years: list of years to index (all years in the archive if None)
+        force: list folders even if they did not change
+        verify: stat all the known files to detect rewritten archive files (one stat per file)
+        """
+        if years is None: dirs = sorted(glob.glob(os.path.join(self.root, "*", "fitacf", self.rad, "")))
+        else: dirs = [os.path.join(self.root, str(y), "fitacf", self.rad, "") for y in years]
+        dmtime = dict(zip(self.dirs["dir"], self.dirs["mtime"]))
+        changed = False
+        for d in dirs:
+            if not os.path.isdir(d): continue
+            mtime = os.stat(d).st_mtime_ns
+            if (not force) and (dmtime.get(d) == mtime) and (not self._modified(d, verify)): continue
+            rows = self._scan_dir(d)
+            files = self.files[~self.files.path.str.startswith(d)]
+            self.files = pd.concat([files, pd.DataFrame(rows, columns=self.columns)], ignore_index=True)
+            dmtime[d] = mtime
+            changed = True
+        if changed:
+            self.dirs = pd.DataFrame({"dir": list(dmtime.keys()), "mtime": list(dmtime.values())})
+            self._bound_extents()
+            self.save()
+        return self
+
+    def _bound_extents(self):
+        """
+        Sort the files and set the end time of files that were not probed
+        """
+        self.files["stime"] = pd.to_datetime(self.files["stime"])
+        self.files["etime"] = pd.to_datetime(self.files["etime"])
+        self.files = self.files.sort_values(by=["stime", "path"]).reset_index(drop=True)
+        nxt = self.files["stime"].shift(-1).fillna(self.files["stime"] + dt.timedelta(days=1))
+        probed = self.files["probed"].astype(bool)
+        self.files.loc[~probed, "etime"] = nxt[~probed]
+        return
+
+    def save(self):
+        """
+        Save the catalog, each csv is written to a temporary file and moved in place so
+        that concurrent readers never see a partial file
+        """
+        os.makedirs(self.catalog_dir, exist_ok=True)
+        for df, fname in [(self.files, self.fname), (self.dirs, self.dname)]:
+            tmp = fname + ".%d.tmp" % os.getpid()
+            df.to_csv(tmp, index=False)
+            os.replace(tmp, fname)
+        return
+
+    def lookup(self, stime, etime):
+        """
+        Sorted interval lookup of the files overlapping [stime, etime]
+        stime: start time
+        etime: end time
+        """
+        st = self.files["stime"].values
+        et = np.maximum.accumulate(self.files["etime"].values) if len(st) > 0 else st
+        i0 = np.searchsorted(et, np.datetime64(stime), side="left")
+        i1 = np.searchsorted(st, np.datetime64(etime), side="right")
+        return self.files["path"].iloc[i0:i1].tolist()
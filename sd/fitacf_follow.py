@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""fitacf_follow.py: module is dedicated to follow the newest fitacf files of a radar in near real time."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import os
+import bz2
+import glob
+import time
+import datetime as dt
+
+from fitacf_catalog import FitacfCatalog
+from get_sd_data import _split_records, _parse_records, records_to_ragged, Scan
+
+class FitacfFollower(object):
+    """
+    Incremental reader of the fitacf files of one radar as they are written.
+    Each poll lists the folder and reads, for every file, only the bytes appended since
+    the previous poll: plain files are read from their last offset and .bz2 files are
+    fed to a decompressor kept per file. Only complete records are parsed, an incomplete
+    tail is kept for the next poll; records of the current (incomplete) scan are held
+    back and a scan is emitted once the first beam of the next scan arrives.
+    By default only the files modified after the follower was created are read, a file
+    being written is read from its start once it is appended to.
+    """
+
+    def __init__(self, rad, folder=None, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], stype="normal", since=None, backfill=False):
+        """
+        Initialize the follower
+        rad: radar code
+        folder: folder receiving the files (local drop folder), the archive folder of the
+                current year of the radar if None
+        s_params: per beam scalar params
+        v_params: per gate vector params
+        stype: scan type
+        since: datetime (UTC), files last modified before are skipped (creation time of the follower if None)
+        backfill: read all the files already in the folder (since is ignored)
+        """
+        self.rad = rad
+        self.folder = folder
+        self.s_params = s_params + [p for p in ["time", "scan"] if p not in s_params]
+        self.v_params = v_params
+        self.params = [p for p in self.s_params + v_params if p != "time"] + ["slist"]
+        self.stype = stype
+        self.since = None if backfill else (since if since is not None else dt.datetime.utcnow())
+        self.state = {}
+        self.pending = []
+        self.last_read = time.time()
+        return
+
+    def _folder(self):
+        """
+        Folder watched by the follower
+        """
+        if self.folder is not None: return self.folder
+        return os.path.join(FitacfCatalog.root, str(dt.datetime.utcnow().year), "fitacf", self.rad)
+
+    def _read_new(self, fname):
+        """
+        Decompressed bytes appended to a file since the previous poll
+        fname: fitacf or fitacf.bz2 file name
+        """
+        st = self.state.setdefault(fname, {"offset": 0, "dec": bz2.BZ2Decompressor() if fname.endswith(".bz2")
+                else None, "buf": b""})
+        with open(fname, "rb") as fp:
+            fp.seek(st["offset"])
+            raw = fp.read()
+        st["offset"] += len(raw)
+        if st["dec"] is None: return raw
+        fs = b""
+        while len(raw) > 0:
+            if st["dec"].eof:
+                raw = st["dec"].unused_data + raw
+                st["dec"] = bz2.BZ2Decompressor()
+            fs += st["dec"].decompress(raw)
+            raw = st["dec"].unused_data if st["dec"].eof else b""
+        return fs
+
+    def _new_records(self, fname):
+        """
+        Parse the complete records appended to a file since the previous poll
+        fname: fitacf or fitacf.bz2 file name
+        """
+        new = self._read_new(fname)
+        fs = self.state[fname]["buf"] + new
+        o = _split_records(fs)
+        self.state[fname]["buf"] = fs[o[-1]:]
+        return _parse_records(fs, o, 0, len(o) - 1, self.params)
+
+    def _files(self):
+        """
+        Files of the radar in the watched folder, in time order
+        """
+        files = sorted(glob.glob(os.path.join(self._folder(), "*.{rad}.fitacf*".format(rad=self.rad))))
+        if self.since is not None:
+            since = self.since.replace(tzinfo=dt.timezone.utc).timestamp()
+            files = [f for f in files if (f in self.state) or (os.path.getmtime(f) >= since)]
+        return files
+
+    def _to_scans(self, records):
+        """
+        Complete scans of the pending and new records, records of the last scan are kept pending
+        """
+        rb = records_to_ragged(self.pending + records, None, self.s_params, self.v_params)
+        so = rb.scan_offsets
+        self.pending = (self.pending + records)[so[-2]:] if rb.nscan > 0 else []
+        scans = []
+        for j in range(rb.nscan - 1):
+            sc = Scan(stype=self.stype, ragged=rb.scan(j))
+            sc.update_time(up=("tfreq" in rb.beams) and ("noise.sky" in rb.beams))
+            scans.append(sc)
+        return scans
+
+    def poll(self):
+        """
+        Read what arrived since the previous poll and return the list of completed scans
+        """
+        records = []
+        for f in self._files():
+            records.extend(self._new_records(f))
+        if len(records) == 0: return []
+        self.last_read = time.time()
+        return self._to_scans(records)
+
+    def flush(self):
+        """
+        Return the pending (possibly incomplete) scan, e.g. at the end of a run
+        """
+        rb = records_to_ragged(self.pending, None, self.s_params, self.v_params)
+        self.pending = []
+        if rb.nbeam == 0: return []
+        sc = Scan(stype=self.stype, ragged=rb)
+        sc.update_time(up=("tfreq" in rb.beams) and ("noise.sky" in rb.beams))
+        return [sc]
+
+    def follow(self, callback=None, interval=60., timeout=None):
+        """
+        Poll the folder every interval seconds and yield the new scans as they complete
+        callback: function called with each new scan
+        interval: seconds between polls
+        timeout: stop after timeout seconds without new data (never if None), the pending scan is then flushed
+        """
+        self.last_read = time.time()
+        while True:
+            for sc in self.poll():
+                if callback is not None: callback(sc)
+                yield sc
+            if (timeout is not None) and (time.time() - self.last_read > timeout):
+                for sc in self.flush():
+                    if callback is not None: callback(sc)
+                    yield sc
+                break
+            time.sleep(interval)
+        return
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""geoloc_cache.py: module is dedicated to load and share the geolocated range cells of the radars."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import os
+import gzip
+import numpy as np
+from netCDF4 import Dataset
+
+class GeolocCache(object):
+    """
+    Cache of the beam x gate geographic lat/lon grid of each radar (written by geoloc.py
+    as data/sim/{rad}.geolocate.data.nc.gz). The compressed file is read in memory once
+    and stored next to it as an uncompressed .npy sidecar [2, nbeam, ngate], which is then
+    memory mapped: the grid is shared through the page cache by all the processes and
+    loaded at most once per process. The sidecar is written atomically and rebuilt when
+    the compressed file is newer.
+    """
+
+    def __init__(self, sim_dir="data/sim/"):
+        """
+        Initialize the cache
+        sim_dir: folder holding the geolocation files
+        """
+        self.sim_dir = sim_dir
+        self.grids = {}
+        return
+
+    def _read_nc(self, fname):
+        """
+        Read lat/lon of the compressed netCDF file in memory, returns [2, nbeam, ngate]
+        """
+        with gzip.open(fname, "rb") as fp:
+            buf = fp.read()
+        with Dataset(os.path.basename(fname), memory=buf) as ds:
+            grid = np.stack([np.ma.filled(ds["geo_lat"][:], np.nan), np.ma.filled(ds["geo_lon"][:], np.nan)])
+        return grid
+
+    def _sidecar(self, rad):
+        """
+        Path of the sidecar, rebuilt from the compressed file if missing or older
+        """
+        fname = os.path.join(self.sim_dir, "{rad}.geolocate.data.nc.gz".format(rad=rad))
+        npy = os.path.join(self.sim_dir, "{rad}.geolocate.data.npy".format(rad=rad))
+        if (not os.path.exists(npy)) or (os.path.getmtime(npy) < os.path.getmtime(fname)):
+            tmp = npy + ".%d.tmp" % os.getpid()
+            with open(tmp, "wb") as fp:
+                np.save(fp, self._read_nc(fname))
+            os.replace(tmp, npy)
+        return npy
+
+    def get(self, rad):
+        """
+        Geographic lat and lon [nbeam, ngate] of the range cells of a radar (read only arrays)
+        rad: radar code
+        """
+        if rad not in self.grids:
+            grid = np.load(self._sidecar(rad), mmap_mode="r")
+            self.grids[rad] = (grid[0], grid[1])
+        return self.grids[rad]
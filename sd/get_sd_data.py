@@ -14,12 +14,303 @@ __status__ = "Research"
 import numpy as np
 import pandas as pd
 import datetime as dt
-import glob
 import bz2
+import time
+import struct
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import pydarn
 
+from fitacf_catalog import FitacfCatalog
+from ragged import RaggedBeams, compact_frame
+from utils import gs_estimation
+
+# Parameters of a fitacf record, one value per beam (scalars) or one value per range gate (vectors)
+FITACF_SCALARS = ["radar.revision.major", "radar.revision.minor", "origin.code", "origin.time", "origin.command",
+        "cp", "stid", "time.yr", "time.mo", "time.dy", "time.hr", "time.mt", "time.sc", "time.us", "txpow", "nave",
+        "atten", "lagfr", "smsep", "ercod", "stat.agc", "stat.lopwr", "noise.search", "noise.mean", "channel",
+        "bmnum", "bmazm", "scan", "offset", "rxrise", "intt.sc", "intt.us", "txpl", "mpinc", "mppul", "mplgs",
+        "mplgexs", "ifmode", "nrang", "frang", "rsep", "xcf", "tfreq", "mxpwr", "lvmax", "algorithm",
+        "fitacf.revision.major", "fitacf.revision.minor", "combf", "noise.sky", "noise.lag0", "noise.vel", "tdiff"]
+FITACF_VECTORS = ["ptab", "ltab", "pwr0", "slist", "nlag", "qflg", "gflg", "p_l", "p_l_e", "p_s", "p_s_e", "v", "v_e",
+        "w_l", "w_l_e", "w_s", "w_s_e", "sd_l", "sd_s", "sd_phi", "x_qflg", "x_gflg", "x_p_l", "x_p_l_e", "x_p_s",
+        "x_p_s_e", "x_v", "x_v_e", "x_w_l", "x_w_l_e", "x_w_s", "x_w_s_e", "phi0", "phi0_e", "elv", "elv_fitted",
+        "elv_error", "elv_low", "elv_high", "x_sd_l", "x_sd_s", "x_sd_phi"]
+TIME_PARAMS = ["time.yr", "time.mo", "time.dy", "time.hr", "time.mt", "time.sc", "time.us"]
+
+# DMAP data type codes and their struct formats (9 is a null terminated string)
+DMAP_TYPES = {1: "b", 2: "h", 3: "i", 4: "f", 8: "d", 10: "q", 16: "B", 17: "H", 18: "I", 19: "Q"}
+DMAP_SIZES = dict((k, struct.calcsize(v)) for k, v in DMAP_TYPES.items())
+
+def split_params(columns):
+    """
+    Split a list of columns into per beam scalar and per gate vector params
+    columns: list of parameters (and "time")
+    """
+    s_params = [p for p in columns if p not in FITACF_VECTORS]
+    v_params = [p for p in columns if p in FITACF_VECTORS]
+    return s_params, v_params
+
+def _split_records(fs):
+    """
+    Byte offsets of the DMAP records in a decompressed fitacf file. Each record
+    starts with an int32 encoding code and an int32 block size (header included),
+    so records are located without parsing them.
+    fs: decompressed bytes
+    """
+    o, cur = [0], 0
+    while cur + 8 <= len(fs):
+        _, size = struct.unpack_from("<ii", fs, cur)
+        if size <= 8 or cur + size > len(fs): break
+        cur += size
+        o.append(cur)
+    return o
+
+def _dmap_name(fs, cur):
+    """
+    Read a null terminated string, returns the string and the next offset
+    """
+    e = fs.index(b"\0", cur)
+    return fs[cur:e].decode(), e + 1
+
+def _decode_records(fs, o, i, j, params):
+    """
+    Decode the records i to j-1 keeping only the given parameters and the record time.
+    Fields that are not kept are skipped using their DMAP type and dimensions, without
+    being decoded. Record layout: code, size, number of scalars, number of arrays, then
+    scalars (name, type, value) and arrays (name, type, ndim, dims, values).
+    """
+    keep = set(params) | set(TIME_PARAMS)
+    records = []
+    for k in range(i, j):
+        d, cur = {}, o[k] + 8
+        snum, anum = struct.unpack_from("<ii", fs, cur)
+        cur += 8
+        for _ in range(snum):
+            name, cur = _dmap_name(fs, cur)
+            tp, cur = fs[cur], cur + 1
+            if tp == 9:
+                x, cur = _dmap_name(fs, cur)
+                if name in keep: d[name] = x
+            else:
+                if name in keep: d[name] = struct.unpack_from("<" + DMAP_TYPES[tp], fs, cur)[0]
+                cur += DMAP_SIZES[tp]
+        for _ in range(anum):
+            name, cur = _dmap_name(fs, cur)
+            tp, cur = fs[cur], cur + 1
+            ndim, = struct.unpack_from("<i", fs, cur)
+            shape = struct.unpack_from("<%di" % ndim, fs, cur + 4)
+            cur += 4 * (ndim + 1)
+            n = int(np.prod(shape))
+            if tp == 9:
+                x = []
+                for _ in range(n):
+                    u, cur = _dmap_name(fs, cur)
+                    x.append(u)
+                if name in keep: d[name] = x
+            else:
+                if name in keep: d[name] = np.frombuffer(fs, "<" + DMAP_TYPES[tp], n, cur).reshape(shape[::-1]).copy()
+                cur += n * DMAP_SIZES[tp]
+        records.append(d)
+    return records
+
+def _project(records, params):
+    """
+    Keep only the given parameters and the record time of parsed records
+    """
+    keep = list(params) + TIME_PARAMS
+    return [dict((p, d[p]) for p in keep if p in d) for d in records]
+
+def _parse_records(fs, o, i, j, params=None):
+    """
+    Parse only the records i to j-1
+    fs: decompressed bytes
+    o: record offsets
+    params: parameters to keep (all parameters, parsed by pydarn, if None)
+    """
+    if j <= i: return []
+    if params is not None: return _decode_records(fs, o, i, j, params)
+    return pydarn.SDarnRead(fs[o[i]:o[j]], True).read_fitacf()
+
+def _bisect_records(fs, o, t, right=False):
+    """
+    Index of the first record with time >= t (time > t if right), records are time sorted
+    and only one record is parsed per bisection step
+    """
+    lo, hi = 0, len(o) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        tm = _record_time(_parse_records(fs, o, mid, mid + 1, [])[0])
+        if (tm <= t) if right else (tm < t): lo = mid + 1
+        else: hi = mid
+    return lo
+
+def _inflate(fname):
+    """
+    Read and decompress one fitacf file, returns the bytes and the read and decompression
+    times [s]; both stages release the GIL so files can be inflated in threads
+    fname: fitacf.bz2 file name
+    """
+    t0 = time.time()
+    with open(fname, "rb") as fp:
+        raw = fp.read()
+    t1 = time.time()
+    fs = bz2.decompress(raw)
+    return fs, t1 - t0, time.time() - t1
+
+def _read_fitacf(fname, date_range=None, params=None, fs=None):
+    """
+    Decompress and parse one fitacf file, used by the worker pool
+    fname: fitacf.bz2 file name
+    date_range: [ start_date, end_date ], if given only the records of the
+                window (located by bisection on record times) are parsed
+    params: parameters to keep in each record (all if None), others are not decoded
+    fs: decompressed bytes of the file if already read (e.g. prefetched)
+    """
+    if fs is None: fs = _inflate(fname)[0]
+    o = _split_records(fs)
+    if o[-1] != len(fs):
+        reader = pydarn.SDarnRead(fs, True)
+        records = reader.read_fitacf()
+        return records if params is None else _project(records, params)
+    n = len(o) - 1
+    i, j = 0, n
+    if (date_range is not None) and (n > 0):
+        t0, t1 = (_record_time(_parse_records(fs, o, k, k + 1, [])[0]) for k in (0, n - 1))
+        if (t0 > date_range[1]) or (t1 < date_range[0]): return []
+        if t0 < date_range[0]: i = _bisect_records(fs, o, date_range[0])
+        if t1 > date_range[1]: j = _bisect_records(fs, o, date_range[1], right=True)
+    return _parse_records(fs, o, i, j, params)
+
+def _read_ragged(fname, date_range, s_params, v_params, cache=None, fs=None):
+    """
+    Decompress, parse and convert one fitacf file into ragged beams, used by the worker pool
+    fname: fitacf.bz2 file name
+    cache: FitacfCache holding the whole file, or None
+    fs: decompressed bytes of the file if already read (e.g. prefetched)
+    """
+    _s = s_params + [p for p in ["time", "scan"] if p not in s_params]
+    params = [p for p in _s + v_params if p != "time"] + ["slist"]
+    if cache is None: return records_to_ragged(_read_fitacf(fname, date_range, params, fs), date_range, _s, v_params)
+    arrs = cache.get(fname, _s + v_params)
+    if arrs is None:
+        rb = records_to_ragged(_read_fitacf(fname, None, params, fs), None, _s, v_params)
+        cache.put(fname, _s + v_params, rb.to_arrays())
+    else: rb = RaggedBeams.from_arrays(arrs)
+    return rb.time_slice(date_range[0], date_range[1])
+
+def _record_time(d):
+    """
+    Datetime of one record
+    d: data dict
+    """
+    return dt.datetime(d["time.yr"], d["time.mo"], d["time.dy"], d["time.hr"], d["time.mt"], d["time.sc"], d["time.us"])
+
+def read_extent(fname):
+    """
+    Time of first and last record of one file, None for an empty file
+    fname: fitacf.bz2 file name
+    """
+    fs = _inflate(fname)[0]
+    o = _split_records(fs)
+    if len(o) < 2: return None
+    return tuple(_record_time(_parse_records(fs, o, i, i + 1, [])[0]) for i in (0, len(o) - 2))
+
+def _empty_column(recs, p, n):
+    """
+    Preallocate one gate column with the dtype of the records, gates
+    of records missing the parameter are filled with NaN (-1 for integers)
+    """
+    dtype = np.float64
+    for d in recs:
+        if p in d:
+            dtype = np.asarray(d[p]).dtype
+            break
+    fill = np.nan if np.issubdtype(dtype, np.floating) else -1
+    return np.full(n, fill, dtype=dtype)
+
+def records_to_ragged(data, date_range, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+        v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"]):
+    """
+    Build ragged beams (flat arrays and beam offsets) straight from the records
+    data: iterable of data dict
+    date_range: [ start_date, end_date ], records outside are dropped (None keeps all)
+    s_params: per beam scalar params
+    v_params: per gate vector params
+    """
+    recs, times = [], []
+    for d in data:
+        time = _record_time(d)
+        if date_range is None or (time >= date_range[0] and time <= date_range[1]):
+            recs.append(d)
+            times.append(time)
+    counts = np.array([len(d["slist"]) if "slist" in d else 0 for d in recs], dtype=np.int64)
+    o = np.zeros(len(recs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=o[1:])
+    beams, gates = {}, {}
+    for p in s_params:
+        if p == "time": beams[p] = np.array(times, dtype="datetime64[us]")
+        else: beams[p] = np.array([d[p] if p in d else np.nan for d in recs])
+    for p in v_params:
+        x = _empty_column(recs, p, o[-1])
+        for i, d in enumerate(recs):
+            if counts[i] > 0 and p in d: x[o[i]:o[i+1]] = d[p]
+        gates[p] = x
+    return RaggedBeams(beams, gates, o)
+
+def _concat_ragged(rbs, date_range, s_params, v_params):
+    """
+    Concatenate the ragged beams of several files, an empty container with
+    the right parameters is returned when there are no files
+    """
+    if len(rbs) == 0:
+        _s = s_params + [p for p in ["time", "scan"] if p not in s_params]
+        rbs = [records_to_ragged([], date_range, _s, v_params)]
+    return RaggedBeams.concat(rbs)
+
+def gs_estimation_beams(beams, methods=[0, 1, 2, 3]):
+    """
+    Batched GS estimation of many beams: one vectorized pass over the gates of all the beams,
+    gsflg[m] and gsflg_prob[m] of each beam are views on the arrays of the whole interval
+    beams: list of beams
+    methods: list of utils.SDScatter methods
+    """
+    bms = []
+    for b in beams:
+        b.gsflg, b.gsflg_prob = {}, {}
+        if len(b.v) > 0 and len(b.w_l) > 0: bms.append(b)
+    if len(bms) == 0: return
+    o = np.r_[0, np.cumsum([len(b.v) for b in bms])]
+    flags, prob = gs_estimation(np.concatenate([b.v for b in bms]), np.concatenate([b.w_l for b in bms]), methods)
+    for i, b in enumerate(bms):
+        for k, m in enumerate(methods):
+            b.gsflg[m], b.gsflg_prob[m] = flags[k, o[i]:o[i+1]], prob[k, o[i]:o[i+1]]
+    return
+
+def gs_estimation_ragged(rb, methods=[0, 1, 2, 3]):
+    """
+    Batched GS estimation over all the range gates of RaggedBeams, adds the
+    gate arrays gsflg.{m} (int8) and gsflg_prob.{m} (float32) for each method
+    rb: RaggedBeams holding v and w_l
+    methods: list of utils.SDScatter methods
+    """
+    flags, prob = gs_estimation(rb.gates["v"], rb.gates["w_l"], methods)
+    for k, m in enumerate(methods):
+        rb.gates["gsflg.%d" % m], rb.gates["gsflg_prob.%d" % m] = flags[k], prob[k]
+    return rb
+
+def _slot(p):
+    """
+    Attribute name of a fitacf parameter, slots have to be identifiers (noise.sky -> noise_sky)
+    """
+    return p.replace(".", "_")
+
 class Gate(object):
-    """Class object to hold each range cell value"""
+    """Class object to hold each range cell value, a view on one range gate of a beam (no copy)"""
+
+    __slots__ = ["_bm", "_i", "_params", "_gflg_type"]
 
     def __init__(self, bm, i, params=["v", "w_l", "gflg", "p_l", "v_e"], gflg_type=-1):
         """
@@ -27,85 +318,132 @@ class Gate(object):
         bm: beam object
         i: index to store
         params: parameters to store
+        gflg_type: read gflg from the GS estimation method gflg_type of the beam if >= 0
         """
-        for p in params:
-            setattr(self, p, getattr(bm, p)[i])
-        if gflg_type >= 0: setattr(self, "gflg", getattr(bm, "gsflg")[gflg_type][i])
+        self._bm, self._i, self._params, self._gflg_type = bm, i, params, gflg_type
         return
 
+    def __getattr__(self, p):
+        if p.startswith("_"): raise AttributeError(p)
+        if p == "gflg" and self._gflg_type >= 0: return self._bm.gsflg[self._gflg_type][self._i]
+        if p not in self._params: raise AttributeError(p)
+        return getattr(self._bm, p)[self._i]
+
 
 class Beam(object):
-    """Class to hold one beam object"""
+    """
+    Class to hold one beam object. The usual parameters are held in slots, any other
+    parameter in the extra dict, which stays None until such a parameter is set (see
+    set_param). Slots have to be identifiers, so the slot of a dotted fitacf parameter is
+    also exposed under its fitacf name, e.g. getattr(bm, "noise.sky") and
+    setattr(bm, "noise.sky", x) use the slot noise_sky.
+    """
+
+    __slots__ = ["time", "bmnum", "noise_sky", "tfreq", "scan", "nrang", "pwr0", "v", "w_l", "gflg",
+            "p_l", "slist", "v_e", "elv", "gsflg", "gsflg_prob", "extra"]
 
     def __init__(self):
         """
         initialize the instance
         """
+        self.extra = None
         return
 
+    def __getattr__(self, p):
+        """
+        Parameters that are not held in the slots are read from extra
+        """
+        if p == "extra": raise AttributeError(p)
+        if self.extra is not None and p in self.extra: return self.extra[p]
+        raise AttributeError(p)
+
+    def set_param(self, p, x):
+        """
+        Set one parameter, in its slot or in extra
+        p: fitacf parameter name
+        x: value
+        """
+        if p in _BEAM_SLOTS: setattr(self, p, x)
+        else:
+            if self.extra is None: self.extra = {}
+            self.extra[p] = x
+        return
+
+    def keys(self):
+        """
+        Names of the parameters set in the beam
+        """
+        keys = [p for p in _BEAM_PARAMS if hasattr(self, p)]
+        if self.extra is not None: keys += list(self.extra.keys())
+        return keys
+
     def set(self, time, d, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang"], 
-            v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"]):
+            v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"], gs=True):
         """
         Set all parameters
         time: datetime of beam
         d: data dict for other parameters
         s_param: other scalar params
         v_params: other list params
+        gs: run the GS estimation of this beam (skip it when it is batched over many beams)
         """
         self.time = time
         for p in s_params:
-            if p in d.keys(): setattr(self, p, d[p])
-            else: setattr(self, p, None)
+            if p in _BEAM_SLOTS: setattr(self, p, d.get(p))
+            else: self.set_param(p, d.get(p))
         for p in v_params:
-            if p in d.keys(): setattr(self, p, d[p])
-            else: setattr(self, p, [])
-        self.gs_estimation()
+            if p in _BEAM_SLOTS: setattr(self, p, d.get(p, []))
+            else: self.set_param(p, d.get(p, []))
+        if gs: self.gs_estimation()
         return
 
     def copy(self, bm):
         """
         Copy all parameters
         """
-        for p in bm.__dict__.keys():
-            setattr(self, p, getattr(bm, p))
+        for p in bm.keys():
+            self.set_param(p, getattr(bm, p))
         return
 
     def gs_estimation(self):
         """
-        Estimate GS flag using different criterion
+        Estimate GS flag using different criterion (see utils.SDScatter)
         Cases - 
                 0. Sundeen et al. |v| + w/3 < 30 m/s
                 1. Blanchard et al. |v| + 0.4w < 60 m/s
                 2. Blanchard et al. [2009] |v| - 0.139w + 0.00113w^2 < 33.1 m/s
+                3. Proposed for SAIS w-[50-{0.7*(v+5)^2}] < 0 m/s
         """
-        self.gsflg = {}
-        self.gsflg_prob = {}
-        if len(self.v) > 0 and len(self.w_l) > 0: 
-            self.gsflg[0] = ((np.abs(self.v) + (self.w_l/3.)) < 30.).astype(int)
-            self.gsflg_prob[0] = 1. / (1 + np.exp(np.abs(self.v) + (self.w_l/3.) - 30.))
-        if len(self.v) > 0 and len(self.w_l) > 0: 
-            self.gsflg[1] = ((np.abs(self.v) + (self.w_l*0.4)) < 60.).astype(int)
-            self.gsflg_prob[1] = 1. / (1 + np.exp(np.abs(self.v) + (self.w_l*0.4) - 60.))
-        if len(self.v) > 0 and len(self.w_l) > 0: 
-            self.gsflg[2] = ((np.abs(self.v) - (0.139*self.w_l) + (0.00113*self.w_l**2)) < 33.1).astype(int)
-            self.gsflg_prob[2] = 1. / (1 + np.exp(np.abs(self.v) + (0.139*self.w_l) + (0.00113*self.w_l**2) - 33.1))
+        gs_estimation_beams([self])
         return
 
 
+# Fitacf names of the parameters held in the slots of a beam, dotted names share the slot descriptor
+_BEAM_PARAMS = [p for p in ["time"] + FITACF_SCALARS + FITACF_VECTORS + ["gsflg", "gsflg_prob"]
+        if _slot(p) in Beam.__slots__]
+_BEAM_SLOTS = set(_BEAM_PARAMS)
+for p in _BEAM_PARAMS:
+    if _slot(p) != p: setattr(Beam, p, Beam.__dict__[_slot(p)])
+
+
 class Scan(object):
     """Class to hold one scan (multiple beams)"""
 
-    def __init__(self, stime=None, etime=None, stype="normal"):
+    __slots__ = ["stime", "etime", "stype", "beams", "ragged", "f", "nsky"]
+
+    def __init__(self, stime=None, etime=None, stype="normal", ragged=None):
         """
         initialize the parameters which will be stored
         stime: start time of scan
         etime: end time of scan
         stype: scan type
+        ragged: RaggedBeams view of the scan, used instead of Beam objects
         """
         self.stime = stime
         self.etime = etime
         self.stype = stype
         self.beams = []
+        self.ragged = ragged
         return
 
     def update_time(self, up=True):
@@ -113,8 +451,12 @@ class Scan(object):
         Update stime and etime of the scan.
         up: Update average parameters if True
         """
-        self.stime = self.beams[0].time
-        self.etime = self.beams[-1].time
+        if self.ragged is not None:
+            t = self.ragged.beams["time"]
+            self.stime, self.etime = t[0].astype(dt.datetime), t[-1].astype(dt.datetime)
+        else:
+            self.stime = self.beams[0].time
+            self.etime = self.beams[-1].time
         if up: self._populate_avg_params()
         return
 
@@ -122,10 +464,13 @@ class Scan(object):
         """
         Polulate average parameetrs
         """
-        f, nsky = [], []
-        for b in self.beams:
-            f.append(getattr(b, "tfreq"))
-            nsky.append(getattr(b, "noise.sky"))
+        if self.ragged is not None:
+            f, nsky = self.ragged.beams["tfreq"], self.ragged.beams["noise.sky"]
+        else:
+            f, nsky = [], []
+            for b in self.beams:
+                f.append(getattr(b, "tfreq"))
+                nsky.append(getattr(b, "noise.sky"))
         self.f, self.nsky = np.mean(f), np.mean(nsky)
         return
 
@@ -133,12 +478,16 @@ class Scan(object):
 class FetchData(object):
     """Class to fetch data from fitacf files for one radar for atleast a day"""
 
-    def __init__(self, rad, date_range, files=None, verbose=True):
+    def __init__(self, rad, date_range, files=None, verbose=True, cache=None, catalog=None, prefetch=2):
         """
         initialize the vars
         rad = radar code
         date_range = [ start_date, end_date ]
         files = List of files to load the data from
+        cache = FitacfCache used by fetch_frame to skip parsing files seen before
+        catalog = FitacfCatalog of the radar used to select the files (created if None)
+        prefetch = number of files read and decompressed ahead in threads while
+                   a file is parsed (0 to read the files strictly one by one)
         e.x :   rad = "sas"
                 date_range = [
                     datetime.datetime(2017,3,17),
@@ -149,69 +498,204 @@ class FetchData(object):
         self.date_range = date_range
         self.files = files
         self.verbose = verbose
+        self.cache = cache
+        self.catalog = catalog
+        self.prefetch = prefetch
+        self.timings = {}
         if (rad is not None) and (date_range is not None) and (len(date_range) == 2):
             self._create_files()
         return
 
     def _create_files(self):
         """
-        Create file names from date and radar code
+        Create file names from date and radar code, by a lookup in the
+        (incrementally updated) fitacf catalog of the radar
         """
         if self.files is None: self.files = []
-        reg_ex = "/sd-data/{year}/fitacf/{rad}/{date}.*.{rad}.fitacf.bz2"
-        days = (self.date_range[1] - self.date_range[0]).days + 1
-        ent = -1
-        for d in range(-1,days):
-            e = self.date_range[0] + dt.timedelta(days=d)
-            fnames = glob.glob(reg_ex.format(year=e.year, rad=self.rad, date=e.strftime("%Y%m%d")))
-            fnames.sort()
-            for fname in fnames:
-                tm = fname.split(".")[1]
-                sc = fname.split(".")[2]
-                dus = dt.datetime.strptime(fname.split(".")[0].split("/")[-1] + tm + sc, "%Y%m%d%H%M%S")
-                due = dus + dt.timedelta(hours=2)
-                if (ent == -1) and (dus <= self.date_range[0] <= due): ent = 0
-                if ent == 0: self.files.append(fname)
-                if (ent == 0) and (dus <= self.date_range[1] <= due): ent = -1
+        if self.catalog is None: self.catalog = FitacfCatalog(self.rad)
+        years = range((self.date_range[0] - dt.timedelta(days=1)).year, self.date_range[1].year + 1)
+        self.catalog.update(years)
+        self.files.extend(self.catalog.lookup(self.date_range[0], self.date_range[1]))
+        return
+
+    def _prefetch(self, depth):
+        """
+        Read and decompress the files ahead in a thread pool and yield (file, bytes) in file
+        order; at most depth files are in flight, which bounds the memory held by the queue
+        depth: number of files read ahead
+        """
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(depth) as ex:
+                pending.extend(ex.submit(_inflate, f) for f in self.files[:depth])
+                for k, f in enumerate(self.files):
+                    t0 = time.time()
+                    fs, t_read, t_inflate = pending.popleft().result()
+                    self.timings["wait"] += time.time() - t0
+                    self.timings["read"] += t_read
+                    self.timings["inflate"] += t_inflate
+                    if k + depth < len(self.files): pending.append(ex.submit(_inflate, self.files[k + depth]))
+                    yield f, fs
+        finally:
+            for p in pending: p.cancel()
         return
 
+    def _iter_records(self, n_procs=1, func=None, params=None, prefetch=None):
+        """
+        Read the files one by one and yield the records of each file
+        n_procs: number of worker processes to decompress and parse files (one file per worker),
+                 records are yielded in file (time) order so the output matches the serial run;
+                 at most n_procs files are submitted ahead, so with a slow consumer at most
+                 n_procs + 1 parsed files are held in memory
+        func: function (picklable) that reads one file, by default only the records
+              within date_range are parsed; it takes the prefetched bytes as keyword fs
+        params: parameters kept in the records by the default reader (all if None)
+        prefetch: number of files read ahead by the serial run (self.prefetch if None)
+
+        Time spent in each stage is accumulated in self.timings [s]: read (file I/O) and
+        inflate (bz2) in the prefetch threads, wait (parser blocked on the prefetch queue)
+        and parse in the calling thread; with n_procs > 1 parse is the wall time.
+        """
+        if func is None: func = partial(_read_fitacf, date_range=self.date_range, params=params)
+        if prefetch is None: prefetch = self.prefetch
+        self.timings = {"read": 0., "inflate": 0., "wait": 0., "parse": 0.}
+        if n_procs > 1 and len(self.files) > 1:
+            depth = min(n_procs, len(self.files))
+            with mp.Pool(depth) as pool:
+                t0 = time.time()
+                pending = deque(pool.apply_async(func, (f,)) for f in self.files[:depth])
+                for k, f in enumerate(self.files):
+                    records = pending.popleft().get()
+                    if k + depth < len(self.files): pending.append(pool.apply_async(func, (self.files[k + depth],)))
+                    if self.verbose: print("Read file - ", f)
+                    yield records
+                self.timings["parse"] = time.time() - t0
+        elif prefetch > 0 and len(self.files) > 1:
+            for f, fs in self._prefetch(prefetch):
+                t0 = time.time()
+                records = func(f, fs=fs)
+                self.timings["parse"] += time.time() - t0
+                if self.verbose: print("Read file - ", f)
+                yield records
+        else:
+            for f in self.files:
+                t0 = time.time()
+                records = func(f)
+                self.timings["parse"] += time.time() - t0
+                if self.verbose: print("Read file - ", f)
+                yield records
+        if self.verbose: print(" Stage timings [s] - " + ", ".join(["%s: %.2f" % (k, v) for k, v in self.timings.items()]))
+        return
+
+    def _to_beams(self, data, s_params, v_params, gs=True):
+        """
+        Convert records into beams lazily, records outside date_range are dropped
+        data: iterable of data dict
+        s_params: other scalar params
+        v_params: other list params
+        gs: run the GS estimation beam by beam
+        """
+        for d in data:
+            time = _record_time(d)
+            if time >= self.date_range[0] and time <= self.date_range[1]:
+                bm = Beam()
+                bm.set(time, d, s_params,  v_params, gs)
+                yield bm
+        return
+
+    def _to_scans(self, beams, stype):
+        """
+        Group beams into scans lazily, a new scan starts at every beam with scan flag 1
+        beams: iterable of beams
+        stype: scan type
+        """
+        sc = None
+        for d in beams:
+            if sc is not None and d.scan == 1:
+                sc.update_time()
+                yield sc
+                sc = None
+            if sc is None: sc = Scan(None, None, stype)
+            sc.beams.append(d)
+        if sc is not None:
+            sc.update_time()
+            yield sc
+        return
+
+    def _segment_scans(self, beams, stype):
+        """
+        Group a list of beams into scans with array operations: scan boundaries come from
+        the scan flag column and the scan averages are reductions over the beams of each scan
+        beams: list of beams
+        stype: scan type
+        """
+        if len(beams) == 0: return []
+        flag = np.array([b.scan for b in beams])
+        starts = np.flatnonzero(flag == 1)
+        if len(starts) == 0 or starts[0] != 0: starts = np.r_[0, starts]
+        ends = np.r_[starts[1:], len(beams)]
+        n = ends - starts
+        f = np.add.reduceat(np.array([b.tfreq for b in beams], dtype=np.float64), starts) / n
+        nsky = np.add.reduceat(np.array([getattr(b, "noise.sky") for b in beams], dtype=np.float64), starts) / n
+        scans = []
+        for j, (i0, i1) in enumerate(zip(starts, ends)):
+            sc = Scan(beams[i0].time, beams[i1-1].time, stype)
+            sc.beams, sc.f, sc.nsky = beams[i0:i1], f[j], nsky[j]
+            scans.append(sc)
+        return scans
+
     def _parse_data(self, data, s_params, v_params, by, scan_prop):
         """
         Parse data by data type
-        data: list of data dict
+        data: iterable of data dict
         params: parameter list to fetch
         by: sort data by beam or scan
         scan_prop: provide scan properties if by='scan'
                         {"stype": type of scan, "dur": duration in min}
         """
-        _b, _s = [], []
+        _s = []
         if self.verbose: print("\n Started converting to beam data.")
-        for d in data:
-            time = dt.datetime(d["time.yr"], d["time.mo"], d["time.dy"], d["time.hr"], d["time.mt"], d["time.sc"], d["time.us"])
-            if time >= self.date_range[0] and time <= self.date_range[1]:
-                bm = Beam()
-                bm.set(time, d, s_params,  v_params)
-                _b.append(bm)
+        _b = list(self._to_beams(data, s_params, v_params, gs=False))
+        gs_estimation_beams(_b)
         if self.verbose: print("\n Converted to beam data.")
         if by == "scan":
             if self.verbose: print("\n Started converting to scan data.")
-            scan, sc =  0, Scan(None, None, scan_prop["stype"])
-            sc.beams.append(_b[0])
-            for d in _b[1:]:
-                if d.scan == 1:
-                    sc.update_time()
-                    _s.append(sc)
-                    sc = Scan(None, None, scan_prop["stype"])
-                    sc.beams.append(d)
-                else: sc.beams.append(d)
+            _s = self._segment_scans(_b, scan_prop["stype"])
             if self.verbose: print("\n Converted to scan data.")
         return _b, _s
 
+    def iter_beams(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang"],
+                        v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"], n_procs=1):
+        """
+        Iterate over the beams file by file, only the records of one file are held in memory
+        s_params: other scalar params
+        v_params: other list params
+        n_procs: number of worker processes to decompress and parse files
+        """
+        records = (d for rs in self._iter_records(n_procs, params=s_params + v_params + ["slist"]) for d in rs)
+        return self._to_beams(records, s_params, v_params)
+
+    def iter_scans(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang"],
+                        v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"], 
+                        scan_prop={"dur": 1, "stype": "normal"}, n_procs=1):
+        """
+        Iterate over the scans file by file, a scan running across two files is yielded once complete
+        s_params: other scalar params
+        v_params: other list params
+        scan_prop: provide scan properties {"stype": type of scan, "dur": duration in min}
+        n_procs: number of worker processes to decompress and parse files
+        """
+        return self._to_scans(self.iter_beams(s_params, v_params, n_procs), scan_prop["stype"])
+
     def convert_to_pandas(self, beams, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
-            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"]):
+            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], compact=False):
         """
         Convert the beam data into dataframe
+        beams: list or iterator (e.g. iter_beams) of beams, or RaggedBeams
+        compact: use the compact schema (ragged.compact_column): float32 physical parameters,
+                 int8/int16 bmnum, scan, gflg, slist and nrang, datetime64 time
         """
+        if isinstance(beams, RaggedBeams): return beams.to_frame(s_params+v_params, compact)
         _o = dict(zip(s_params+v_params, ([] for _ in s_params+v_params)))
         for b in beams:
             l = len(getattr(b, "slist"))
@@ -219,30 +703,125 @@ class FetchData(object):
                 _o[p].extend(getattr(b, p))
             for p in s_params:
                 _o[p].extend([getattr(b, p)]*l)
-
+        if compact: return compact_frame(pd.DataFrame(_o))
         return pd.DataFrame.from_records(_o)
 
+    def fetch_ragged(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], n_procs=1, columns=None,
+            gs_methods=None):
+        """
+        Fetch data into RaggedBeams (one flat array per parameter plus beam and scan offsets)
+        without building Beam objects. Only the requested parameters are decoded from the
+        files, all other fields are skipped; time and scan flag are always kept per beam.
+        s_params: per beam scalar params
+        v_params: per gate vector params
+        n_procs: number of worker processes to decompress, parse and convert files
+        columns: exact list of columns to fetch, overrides s_params and v_params
+        gs_methods: list of utils.SDScatter methods for a batched GS estimation (needs v and w_l)
+        """
+        if columns is not None: s_params, v_params = split_params(columns)
+        s_params = [p for p in s_params if p != "scan_id"]
+        func = partial(_read_ragged, date_range=self.date_range, s_params=s_params, v_params=v_params,
+                cache=self.cache)
+        rbs = list(self._iter_records(n_procs, func, prefetch=0 if self.cache is not None else None))
+        rb = _concat_ragged(rbs, self.date_range, s_params, v_params)
+        if gs_methods is not None: gs_estimation_ragged(rb, gs_methods)
+        return rb
+
+    def fetch_scans(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], scan_prop={"dur": 1, "stype": "normal"},
+            n_procs=1, columns=None):
+        """
+        Fetch data into scans without building Beam objects, returns the RaggedBeams and the
+        list of scans; each scan is a view on it and its times and averages are computed for
+        all the scans at once by RaggedBeams.scan_summary
+        s_params: per beam scalar params
+        v_params: per gate vector params
+        scan_prop: provide scan properties {"stype": type of scan, "dur": duration in min}
+        n_procs: number of worker processes to decompress, parse and convert files
+        columns: exact list of columns to fetch, overrides s_params and v_params
+        """
+        if columns is not None: s_params, v_params = split_params(columns)
+        rb = self.fetch_ragged(s_params, v_params, n_procs)
+        summary = rb.scan_summary()
+        stime, etime = summary["stime"].values.astype("datetime64[us]").astype(object), \
+                summary["etime"].values.astype("datetime64[us]").astype(object)
+        f, nsky = summary.get("tfreq", np.nan + summary["nbeam"]), summary.get("noise.sky", np.nan + summary["nbeam"])
+        _s = []
+        for j in range(rb.nscan):
+            sc = Scan(stime[j], etime[j], scan_prop["stype"], rb.scan(j))
+            sc.f, sc.nsky = f.values[j], nsky.values[j]
+            _s.append(sc)
+        return rb, _s
+
+    def fetch_frame(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], n_procs=1, columns=None, compact=False):
+        """
+        Fetch data straight into a dataframe without building Beam objects,
+        the schema is the same as convert_to_pandas
+        s_params: per beam scalar params, scan_id adds the scan index of each beam (see RaggedBeams)
+        v_params: per gate vector params
+        n_procs: number of worker processes to decompress, parse and convert files
+        columns: exact list of columns to fetch, overrides s_params and v_params
+        compact: use the compact schema (see convert_to_pandas)
+        """
+        if columns is not None: s_params, v_params = split_params(columns)
+        return self.fetch_ragged(s_params, v_params, n_procs).to_frame(s_params+v_params, compact)
+
     def fetch_data(self, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang"],
                         v_params=["pwr0", "v", "w_l", "gflg", "p_l", "slist", "v_e"],
-                        by="beam", scan_prop={"dur": 1, "stype": "normal"}):
+                        by="beam", scan_prop={"dur": 1, "stype": "normal"}, n_procs=1):
         """
         Fetch data from file list and return the dataset
         params: parameter list to fetch
         by: sort data by beam or scan
         scan_prop: provide scan properties if by='scan' 
                    {"stype": type of scan, "dur": duration in min}
+        n_procs: number of worker processes to decompress and parse files (one file per worker),
+                 records are merged back in file (time) order so the output matches the serial run
         """
-        data = []
-        for f in self.files:
-            with bz2.open(f) as fp:
-                fs = fp.read()
-            if self.verbose: print("Read file - ", f)
-            reader = pydarn.SDarnRead(fs, True)
-            records = reader.read_fitacf()
-            data += records
+        params = s_params + v_params + ["slist"] if by is not None else None
+        data = (d for rs in self._iter_records(n_procs, params=params) for d in rs)
         if by is not None: data = self._parse_data(data, s_params, v_params, by, scan_prop)
+        else: data = list(data)
         return data
 
+def fetch_radars(rads, date_range, s_params=["bmnum", "noise.sky", "tfreq", "scan", "nrang", "time"],
+        v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"], n_procs=4, columns=None, cache=None,
+        concat=False, compact=False):
+    """
+    Fetch several radars concurrently into dataframes (schema of FetchData.fetch_frame).
+    The files of all the radars go through one shared worker pool, so the run takes
+    about the time of the slowest radar rather than the sum over radars.
+    rads: list of radar codes
+    date_range: [ start_date, end_date ]
+    s_params: per beam scalar params, scan_id adds the scan index of each beam (see RaggedBeams)
+    v_params: per gate vector params
+    n_procs: number of worker processes shared by all the radars
+    columns: exact list of columns to fetch, overrides s_params and v_params
+    cache: FitacfCache shared by all the radars, or None
+    concat: return one dataframe with a rad column instead of a dict of dataframes by radar
+    compact: use the compact schema (see FetchData.convert_to_pandas)
+    """
+    if columns is not None: s_params, v_params = split_params(columns)
+    fds = [FetchData(rad, date_range, verbose=False, cache=cache) for rad in rads]
+    files = [f for fd in fds for f in fd.files]
+    f_params = [p for p in s_params if p != "scan_id"]
+    func = partial(_read_ragged, date_range=date_range, s_params=f_params, v_params=v_params, cache=cache)
+    if n_procs > 1 and len(files) > 1:
+        with mp.Pool(min(n_procs, len(files))) as pool:
+            rbs = pool.map(func, files, chunksize=1)
+    else: rbs = [func(f) for f in files]
+    o, i = {}, 0
+    for fd in fds:
+        rb = _concat_ragged(rbs[i:i + len(fd.files)], date_range, f_params, v_params)
+        o[fd.rad] = rb.to_frame(s_params+v_params, compact)
+        i += len(fd.files)
+    if concat:
+        o = pd.concat([df.assign(rad=rad) for rad, df in o.items()], ignore_index=True)
+        if compact: o["rad"] = o["rad"].astype("category")
+    return o
+
 if __name__ == "__main__":
     fdata = FetchData( "sas", [dt.datetime(2015,3,17,3),
         dt.datetime(2015,3,17,3,20)] )
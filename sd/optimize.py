@@ -21,7 +21,8 @@ from dateutil import parser as dparser
 import numpy as np
 import pandas as pd
 
-from get_sd_data import FetchData
+from get_sd_data import FetchData, fetch_radars
+from fitacf_cache import FitacfCache
 import utils
 from utils import SDScatter
 from skills import Skills
@@ -39,13 +40,15 @@ from misc import Misc
 class Model(object):
     """ Class is dedicated to run a model and optimize the parameters """
 
-    def __init__(self, rad, stime, etime, args):
+    def __init__(self, rad, stime, etime, args, rec=None):
         """
         Initialize all the parameters needed to run the model
+        rec: data of the radar if already fetched (e.g. by fetch_radars), fetched by _ini_ if None
         """
         self.rad = rad
         self.stime = stime
         self.etime = etime
+        self.rec = rec
         self.create_folder()
         for k in vars(args).keys():
             setattr(self, k, vars(args)[k])
@@ -73,6 +76,8 @@ class Model(object):
                 "bhscore": self.skill.bhscore, "hscore": self.skill.hscore, "xuscore": self.skill.xuscore,
                 "xiebenie": self.skill.xiebenie}
         dat.to_netcdf(fname)
+        if hasattr(self, "tx"): self.tx.save(fname.replace(".nc", ".boxcox.json"))
+        if hasattr(self, "scaler"): self.scaler.save(fname.replace(".nc", ".minmax.json"))
         return
 
     def _plot_estimates_(self):
@@ -100,20 +105,35 @@ class Model(object):
             break
         return
 
-    def _ini_(self, params=["bmnum", "noise.sky", "tfreq", "v", "p_l", "w_l", "slist", "elv", "time_index"], 
-            v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"]):
+    @staticmethod
+    def columns(params=["bmnum", "noise.sky", "tfreq", "v", "p_l", "w_l", "slist", "elv", "time_index"]):
         """
-        Model initialize
+        Columns to fetch for the model parameters, with the scan index of each beam
+        """
+        return [p for p in params if p not in ["time_index", "scan_id"]] + ["time", "scan_id"]
+
+    def _ini_(self, params=["bmnum", "noise.sky", "tfreq", "v", "p_l", "w_l", "slist", "elv", "time_index"]):
+        """
+        Model initialize, only the columns needed by params are fetched
         """
         print([self.stime, self.etime])
-        fd = FetchData(self.rad, [self.stime, self.etime])
-        beams, _ = fd.fetch_data(v_params=v_params)
-        self.rec = fd.convert_to_pandas(beams)
+        if self.rec is None:
+            cache = FitacfCache() if hasattr(self, "cache") and self.cache else None
+            fd = FetchData(self.rad, [self.stime, self.etime], cache=cache)
+            n_procs = self.n_procs if hasattr(self, "n_procs") else 1
+            compact = hasattr(self, "compact") and self.compact
+            self.rec = fd.fetch_frame(columns=Model.columns(params), n_procs=n_procs, compact=compact)
         print(self.rec.head())
-        self.rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in self.rec["time"].tolist()])
+        self.rec["time_index"] = utils.time_days_to_index(self.rec["time"].values)
+        if hasattr(self, "compact") and self.compact: self.rec["time_index"] = self.rec["time_index"].astype(np.float32)
         self.rec["time"] = getD2N(self.rec["time"].tolist())
-        if hasattr(self, "boxcox") and self.boxcox: self.rec = utils.boxcox_tx(self.rec)
-        if hasattr(self, "norm") and self.norm: self.rec = utils.normalize(self.rec, params)
+        if hasattr(self, "boxcox") and self.boxcox:
+            n_procs = self.n_procs if hasattr(self, "n_procs") else 1
+            self.tx = utils.BoxCoxTransform().fit(self.rec, sample=100000, n_procs=n_procs)
+            self.tx.transform(self.rec)
+        if hasattr(self, "norm") and self.norm:
+            self.scaler = utils.MinMaxNormalizer(params).fit(self.rec)
+            self.scaler.transform(self.rec)
         if self.verbose: print("\n",self.rec.head())
         return
 
@@ -172,6 +192,9 @@ if __name__ == "__main__":
     parser.add_argument("-v", "--verbose", action="store_true", help="Increase output verbosity (default False)")
     parser.add_argument("-sv", "--save", action="store_true", help="Increase output verbosity (default False)")
     parser.add_argument("-gs", "--gs_method", default=0, help="IS/GS method to detect")
+    parser.add_argument("-ca", "--cache", action="store_true", help="Cache parsed fitacf files in data/cache/ (default False)")
+    parser.add_argument("-np", "--n_procs", type=int, default=1, help="Number of processes to read fitacf files (default 1)")
+    parser.add_argument("-cp", "--compact", action="store_true", help="Use float32/int8/int16 columns (default False)")
     args = parser.parse_args()
     if args.verbose:
         print("\n Parameter list for simulation ")
@@ -184,10 +207,12 @@ if __name__ == "__main__":
         for start in dates.dn.tolist():
             args.start = start
             args.end = start + dt.timedelta(days=1)
+            cache = FitacfCache() if args.cache else None
+            recs = fetch_radars(rads.rad.tolist(), [args.start, args.end], columns=Model.columns(),
+                    n_procs=max(args.n_procs, 1), cache=cache, compact=args.compact)
             for rad in rads.rad.tolist():
                 args.rad = rad
-                Model(args.rad, args.start, args.end, args)
-                break
+                Model(args.rad, args.start, args.end, args, recs[rad])
             break
     print("")
     _del_()
@@ -22,10 +22,28 @@ from matplotlib import patches
 import matplotlib.patches as mpatches
 import random
 
+from ragged import RaggedBeams
+
 def getD2N(dates):
     """ Returns date to numbs"""
     return [date2num(d) for d in dates]
 
+def ragged_to_dict(data_dict, params, aliases={}, by_scan=False):
+    """
+    Convert RaggedBeams into the dict layout used by the plots (time as date numbers),
+    any other data_dict is returned as is
+    params: parameters to convert
+    aliases: rename parameters, e.g. {"slist": "gate"}
+    by_scan: one array per scan for each parameter if True, flat arrays otherwise
+    """
+    if not isinstance(data_dict, RaggedBeams): return data_dict
+    o = {}
+    for p in params:
+        x = data_dict.per_scan(p) if by_scan else data_dict.gate_column(p)
+        if p == "time": x = [date2num(t) for t in x] if by_scan else date2num(x)
+        o[aliases.get(p, p)] = x
+    return o
+
 class MultiDayPlotter:
 
     def __init__(self, models):
@@ -205,6 +223,7 @@ class RangeTimePlot(object):
         # add new axis
         self.cluster_ax = self._add_axis()
         # set up variables for plotter
+        data_dict = ragged_to_dict(data_dict, ["time", "slist", "bmnum"])
         time = np.hstack(data_dict["time"])
         gate = np.hstack(data_dict["slist"])
         allbeam = np.hstack(data_dict["bmnum"])
@@ -227,6 +246,7 @@ class RangeTimePlot(object):
         # add new axis
         self.isgs_ax = self._add_axis()
         # set up variables for plotter
+        data_dict = ragged_to_dict(data_dict, ["time", "slist", "bmnum"])
         time = np.hstack(data_dict["time"])
         gate = np.hstack(data_dict["slist"])
         allbeam = np.hstack(data_dict["bmnum"])
@@ -254,6 +274,7 @@ class RangeTimePlot(object):
         # add new axis
         self.vel_ax = self._add_axis()
         # set up variables for plotter
+        data_dict = ragged_to_dict(data_dict, ["time", "slist", "bmnum", "v"])
         time = np.hstack(data_dict["time"])
         gate = np.hstack(data_dict["slist"])
         allbeam = np.hstack(data_dict["bmnum"])
@@ -389,6 +410,8 @@ class FanPlot:
     def plot_clusters(self, data_dict, clust_flg, scans, name,
                       vel_max=200, vel_step=25,
                       show=True, save=False, base_filepath=""):
+        data_dict = ragged_to_dict(data_dict, ["bmnum", "slist", "v", "time"], 
+                aliases={"bmnum": "beam", "slist": "gate", "v": "vel"}, by_scan=True)
         unique_clusters = np.unique(np.hstack(clust_flg))
         noise = -1 in unique_clusters
         cluster_cmap = get_cluster_cmap(len(unique_clusters), noise)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""ragged.py: module is dedicated to hold beams of range gate vectors in flat arrays."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+import numpy as np
+import pandas as pd
+
+# Compact dataframe schema: small integers for the indices and flags, datetime64 for time and
+# float32 for the physical parameters (see compact_column)
+COMPACT_DTYPES = {"bmnum": np.int8, "scan": np.int8, "gflg": np.int8, "slist": np.int16, "nrang": np.int16}
+
+def compact_column(x, p):
+    """
+    Cast one column to the compact schema: COMPACT_DTYPES (float32 if there are NaN), datetime64
+    for times, int8/int16 for other integers when they fit and float32 for other numbers, so a
+    block of compact columns never upcasts to float64
+    x: array or list
+    p: parameter name
+    """
+    x = np.asarray(x)
+    if x.dtype == object and len(x) > 0 and hasattr(x[0], "year"): return pd.to_datetime(x).values
+    if not np.issubdtype(x.dtype, np.number): return x
+    if p in COMPACT_DTYPES or np.issubdtype(x.dtype, np.integer):
+        if np.issubdtype(x.dtype, np.floating) and np.isnan(x).any(): return x.astype(np.float32)
+        dtype = COMPACT_DTYPES.get(p)
+        if dtype is None:
+            lo, hi = (x.min(), x.max()) if len(x) > 0 else (0, 0)
+            dtype = next((t for t in [np.int8, np.int16] if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max), np.float32)
+        return x.astype(dtype)
+    return x.astype(np.float32)
+
+def compact_frame(df):
+    """
+    Cast all the columns of a dataframe to the compact schema
+    """
+    return pd.DataFrame(dict((p, compact_column(df[p].values, p)) for p in df.columns))
+
+class RaggedBeams(object):
+    """
+    Ragged container of beams.
+        beams: one array per beam parameter (time, bmnum, scan, ...), length nbeam
+        gates: one flat typed array per range gate parameter (v, w_l, slist, ...)
+        offsets: gates of beam i are gates[p][offsets[i]:offsets[i+1]], length nbeam+1
+        scan_offsets: beams of scan j are beams[p][scan_offsets[j]:scan_offsets[j+1]],
+                      a scan starts at every beam with scan flag 1
+    The scan index of each beam is exposed as the derived parameter scan_id, so that a
+    dataframe (one row per gate, beams without echoes have no row) keeps the scans.
+    Slicing by beam, scan or time returns views on the same arrays (no data copy).
+    """
+
+    def __init__(self, beams, gates, offsets, scan_offsets=None):
+        """
+        Initialize the container
+        beams: dict of per beam arrays
+        gates: dict of per gate arrays
+        offsets: gate offsets of each beam
+        scan_offsets: beam offsets of each scan (computed from the scan flag if None)
+        """
+        self.beams = beams
+        self.gates = gates
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._scan_offsets = scan_offsets
+        return
+
+    @property
+    def nbeam(self):
+        return len(self.offsets) - 1
+
+    @property
+    def ngate(self):
+        return int(self.offsets[-1] - self.offsets[0])
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def scan_offsets(self):
+        """
+        Beam offsets of each scan, from the scan flag of the beams
+        """
+        if self._scan_offsets is None:
+            if self.nbeam == 0: self._scan_offsets = np.zeros(1, dtype=np.int64)
+            elif "scan" in self.beams:
+                starts = np.flatnonzero(self.beams["scan"] == 1)
+                if len(starts) == 0 or starts[0] != 0: starts = np.r_[0, starts]
+                self._scan_offsets = np.r_[starts, self.nbeam].astype(np.int64)
+            else: self._scan_offsets = np.array([0, self.nbeam], dtype=np.int64)
+        return self._scan_offsets
+
+    @property
+    def nscan(self):
+        return len(self.scan_offsets) - 1
+
+    @property
+    def scan_index(self):
+        """
+        Index of the scan of each beam
+        """
+        return np.repeat(np.arange(self.nscan), np.diff(self.scan_offsets))
+
+    def beam_column(self, p):
+        """
+        One value per beam of beam parameter p, scan_id is derived from the scan offsets
+        """
+        if p == "scan_id" and p not in self.beams: return self.scan_index
+        return self.beams[p]
+
+    def _sub(self, b0, b1, scan_offsets=None):
+        """
+        View on the beams b0 to b1-1
+        """
+        g0, g1 = self.offsets[b0], self.offsets[b1]
+        beams = dict((p, x[b0:b1]) for p, x in self.beams.items())
+        gates = dict((p, x[g0 - self.offsets[0]:g1 - self.offsets[0]]) for p, x in self.gates.items())
+        return RaggedBeams(beams, gates, self.offsets[b0:b1+1] - g0, scan_offsets)
+
+    def beam(self, i):
+        """
+        Parameters of beam i as a dict, gate parameters are views
+        """
+        g0, g1 = self.offsets[i] - self.offsets[0], self.offsets[i+1] - self.offsets[0]
+        b = dict((p, x[i]) for p, x in self.beams.items())
+        b.update(dict((p, x[g0:g1]) for p, x in self.gates.items()))
+        return b
+
+    def scan(self, j):
+        """
+        View on scan j
+        """
+        b0, b1 = self.scan_offsets[j], self.scan_offsets[j+1]
+        return self._sub(b0, b1, np.array([0, b1 - b0], dtype=np.int64))
+
+    def time_slice(self, stime, etime):
+        """
+        View on the beams with stime <= time <= etime, beams are time sorted
+        """
+        t = self.beams["time"]
+        b0 = np.searchsorted(t, np.datetime64(stime), side="left")
+        b1 = np.searchsorted(t, np.datetime64(etime), side="right")
+        return self._sub(b0, b1)
+
+    def gate_column(self, p):
+        """
+        One value per range gate, beam parameters are broadcast over the gates of each beam
+        """
+        if p in self.gates: return self.gates[p]
+        return np.repeat(self.beam_column(p), self.counts)
+
+    def per_scan(self, p):
+        """
+        List of per gate arrays (views) of parameter p, one per scan
+        """
+        x = self.gate_column(p)
+        g = self.offsets[self.scan_offsets] - self.offsets[0]
+        return [x[g[j]:g[j+1]] for j in range(self.nscan)]
+
+    def scan_reduce(self, p, ufunc=np.add, dtype=None):
+        """
+        One value per scan of beam parameter p, reduced over the beams of each scan in one pass
+        p: beam parameter
+        ufunc: reduction, e.g. np.add, np.minimum, np.maximum
+        dtype: accumulator type
+        """
+        return ufunc.reduceat(self.beams[p], self.scan_offsets[:-1], dtype=dtype)
+
+    def scan_mean(self, p):
+        """
+        Mean of beam parameter p over the beams of each scan
+        """
+        return self.scan_reduce(p, dtype=np.float64) / np.diff(self.scan_offsets)
+
+    def scan_summary(self, means=["tfreq", "noise.sky"]):
+        """
+        Dataframe with one row per scan: first beam, number of beams, start and end time
+        and the mean of the given beam parameters (those that are present)
+        means: beam parameters to average
+        """
+        so = self.scan_offsets
+        o = {"beam": so[:-1], "nbeam": np.diff(so)}
+        if "time" in self.beams:
+            t = self.beams["time"]
+            o["stime"], o["etime"] = t[so[:-1]], t[so[1:] - 1]
+        for p in means:
+            if p in self.beams: o[p] = self.scan_mean(p)
+        return pd.DataFrame(o)
+
+    def scan_dict(self, params, aliases={}):
+        """
+        Dict of per scan lists, the layout used by the grid-based DBSCAN and the fan plots
+        params: parameters
+        aliases: rename parameters, e.g. {"slist": "gate"}
+        """
+        return dict((aliases.get(p, p), self.per_scan(p)) for p in params)
+
+    def to_frame(self, params=None, compact=False):
+        """
+        Dataframe with one row per range gate (schema of FetchData.convert_to_pandas)
+        params: columns (all beam and gate parameters if None)
+        compact: cast the columns to the compact schema (see compact_column), beam
+                 parameters are cast before being broadcast over the gates
+        """
+        if params is None: params = list(self.beams.keys()) + list(self.gates.keys())
+        if not compact: return pd.DataFrame(dict((p, self.gate_column(p)) for p in params))
+        o = {}
+        for p in params:
+            if p in self.gates: o[p] = compact_column(self.gates[p], p)
+            else: o[p] = np.repeat(compact_column(self.beam_column(p), p), self.counts)
+        return pd.DataFrame(o)
+
+    def to_arrays(self):
+        """
+        Flat dict of arrays, e.g. to store in a .npz
+        """
+        o = {"offsets": self.offsets - self.offsets[0]}
+        o.update(dict(("b:" + p, x) for p, x in self.beams.items()))
+        o.update(dict(("g:" + p, x) for p, x in self.gates.items()))
+        return o
+
+    @staticmethod
+    def from_arrays(arrs):
+        """
+        Inverse of to_arrays
+        """
+        beams = dict((k[2:], x) for k, x in arrs.items() if k.startswith("b:"))
+        gates = dict((k[2:], x) for k, x in arrs.items() if k.startswith("g:"))
+        return RaggedBeams(beams, gates, arrs["offsets"])
+
+    @staticmethod
+    def from_frame(df, v_params):
+        """
+        Build from a dataframe with one row per range gate, a new beam starts
+        whenever time or beam number changes; scans are split on the scan_id column if
+        present (see to_frame), else on the scan flag of the first beam of each scan
+        df: dataframe
+        v_params: per gate columns, all other columns are per beam
+        """
+        t, bm = df["time"].values, df["bmnum"].values
+        new = np.r_[True, (t[1:] != t[:-1]) | (bm[1:] != bm[:-1])] if len(df) > 0 else np.zeros(0, dtype=bool)
+        starts = np.flatnonzero(new)
+        beams = dict((p, df[p].values[starts]) for p in df.columns if p not in v_params)
+        gates = dict((p, df[p].values) for p in df.columns if p in v_params)
+        scan_offsets = None
+        if "scan_id" in beams:
+            sid = beams["scan_id"]
+            scan_offsets = np.r_[0, np.flatnonzero(sid[1:] != sid[:-1]) + 1, len(sid)] if len(sid) > 0 \
+                    else np.zeros(1, dtype=np.int64)
+        return RaggedBeams(beams, gates, np.r_[starts, len(df)], scan_offsets)
+
+    @staticmethod
+    def concat(rbs):
+        """
+        Concatenate several containers (e.g. one per file) in order
+        rbs: list of RaggedBeams
+        """
+        rbs = [r for r in rbs if r.nbeam > 0] or rbs[:1]
+        beams = dict((p, np.concatenate([r.beams[p] for r in rbs])) for p in rbs[0].beams.keys())
+        gates = dict((p, np.concatenate([r.gates[p] for r in rbs])) for p in rbs[0].gates.keys())
+        counts = np.concatenate([r.counts for r in rbs])
+        return RaggedBeams(beams, gates, np.r_[0, np.cumsum(counts)])
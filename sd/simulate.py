@@ -39,9 +39,8 @@ def run_all_partion_clustering(rad, date_range, boxcox=True, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -65,9 +64,8 @@ def run_all_hierarchi_clustering(rad, date_range, boxcox=True, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -92,9 +90,8 @@ def run_all_mixtures_clustering(rad, date_range, boxcox=True, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -119,9 +116,8 @@ def run_all_densitybased_clustering(rad, date_range, boxcox=False, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -145,9 +141,8 @@ def run_all_spectral_clustering(rad, date_range, boxcox=False, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -171,9 +166,8 @@ def run_all_gridbased_clustering(rad, date_range, boxcox=False, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
@@ -196,9 +190,8 @@ def run_all_misc_clustering(rad, date_range, boxcox=False, norm=True,
     date_range: Date range
     """
     fd = FetchData(rad, date_range)
-    beams, _ = fd.fetch_data(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
-    rec = fd.convert_to_pandas(beams)
-    rec["time_index"] = utils.time_days_to_index([x.to_pydatetime() for x in rec["time"].tolist()])
+    rec = fd.fetch_frame(v_params=["elv", "v", "w_l", "gflg", "p_l", "slist", "v_e"])
+    rec["time_index"] = utils.time_days_to_index(rec["time"].values)
     if boxcox: rec = utils.boxcox_tx(rec)
     if norm: rec = utils.normalize(rec, params)
     print("\n",rec.head())
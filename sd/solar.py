@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""solar.py: module is dedicated to compute the solar zenith and azimuth angles of the range cells."""
+
+__author__ = "Chakraborty, S."
+__copyright__ = "Copyright 2020, SuperDARN@VT"
+__credits__ = []
+__license__ = "MIT"
+__version__ = "1.0."
+__maintainer__ = "Chakraborty, S."
+__email__ = "shibaji7@vt.edu"
+__status__ = "Research"
+
+from functools import lru_cache
+import numpy as np
+
+from geoloc_cache import GeolocCache
+
+# Geolocation grids of the radars shared by all the calls of this process
+_geoloc = GeolocCache()
+
+def solar_position(times, lat, lon):
+    """
+    Solar zenith and azimuth angles (degrees, geometric: no refraction) with the NOAA
+    solar calculator equations, vectorized and broadcast over times and locations
+    times: datetime64 (UTC) array or list of datetime
+    lat: geographic latitude (degrees)
+    lon: geographic longitude (degrees east)
+    """
+    sec = np.asarray(times, dtype="datetime64[us]").astype(np.int64) / 1e6
+    lat, lon = np.radians(lat), np.asarray(lon, dtype=np.float64)
+    jc = (sec / 86400. + 2440587.5 - 2451545.) / 36525.
+    l0 = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360.)
+    m = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    e = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    c = np.sin(m) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) + np.sin(2 * m) * (0.019993 - 0.000101 * jc) \
+            + np.sin(3 * m) * 0.000289
+    omega = np.radians(125.04 - 1934.136 * jc)
+    app_long = np.radians(np.degrees(l0) + c - 0.00569 - 0.00478 * np.sin(omega))
+    obliq = np.radians(23. + (26. + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60.) / 60.
+            + 0.00256 * np.cos(omega))
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+    y = np.tan(obliq / 2.) ** 2
+    eq_time = 4. * np.degrees(y * np.sin(2 * l0) - 2 * e * np.sin(m) + 4 * e * y * np.sin(m) * np.cos(2 * l0)
+            - 0.5 * y**2 * np.sin(4 * l0) - 1.25 * e**2 * np.sin(2 * m))
+    tst = ((sec % 86400.) / 60. + eq_time + 4. * lon) % 1440.
+    ha = np.radians(tst / 4. - 180.)
+    cos_zen = np.clip(np.sin(lat) * np.sin(decl) + np.cos(lat) * np.cos(decl) * np.cos(ha), -1., 1.)
+    zen = np.arccos(cos_zen)
+    cos_azm = np.clip((np.sin(lat) * cos_zen - np.sin(decl)) / (np.cos(lat) * np.sin(zen)), -1., 1.)
+    azm = np.degrees(np.arccos(cos_azm))
+    azm = np.where(ha > 0, (azm + 180.) % 360., (540. - azm) % 360.)
+    return np.degrees(zen), azm
+
+@lru_cache(maxsize=2048)
+def _solar_grid(rad, t):
+    """
+    Memoized zenith and azimuth [nbeam, ngate] of a radar at one scan time, 2048 entries
+    hold a day of one minute scans
+    t: scan time (datetime64[us] as int, so it is hashable)
+    """
+    lat, lon = _geoloc.get(rad)
+    zen, azm = solar_position(np.datetime64(t, "us"), lat, lon)
+    zen.flags.writeable, azm.flags.writeable = False, False
+    return zen, azm
+
+def solar_grid(rad, time):
+    """
+    Solar zenith and azimuth [nbeam, ngate] of all the range cells of a radar at one
+    scan time, memoized per (radar, scan time)
+    rad: radar code
+    time: scan (start) time, datetime or datetime64
+    """
+    return _solar_grid(rad, int(np.datetime64(time, "us").astype(np.int64)))
+
+def solar_angles(rad, times, beams, gates):
+    """
+    Solar zenith and azimuth of each echo at its own time, computed in one vectorized
+    call on the locations of the echoes (no grid: beam soundings are too many to memoize)
+    rad: radar code
+    times: datetime64 array (or list of datetime) of the echoes
+    beams: beam numbers
+    gates: range gates
+    """
+    lat, lon = _geoloc.get(rad)
+    beams, gates = np.asarray(beams, dtype=np.int64), np.asarray(gates, dtype=np.int64)
+    return solar_position(times, lat[beams, gates], lon[beams, gates])
@@ -11,14 +11,16 @@ __maintainer__ = "Chakraborty, S."
 __email__ = "shibaji7@vt.edu"
 __status__ = "Research"
 
-import os
+import json
+import multiprocessing as mp
 import numpy as np
-from scipy.stats import boxcox
+from scipy.stats import boxcox_normmax
 from scipy import stats
 from scipy.stats import beta
-from pysolar.solar import get_altitude
-from netCDF4 import Dataset
-from sklearn.preprocessing import MinMaxScaler
+from scipy import special
+from scipy.special import expit
+
+from solar import solar_angles, solar_grid
 
 class SDScatter(object):
     """ SuperDARN scatter detection and identification module """
@@ -47,79 +49,263 @@ class SDScatter(object):
         if self.method == 3: u = "Proposed.SAIS"
         return u
     
+    @staticmethod
+    def discriminant(v, w, method):
+        """
+        Criterion of a method written as d < 0 for GS (also the logit of the GS probability)
+        v: velocity array
+        w: spectral width array
+        """
+        if method == 0: d = np.abs(v) + w/3. - 30.
+        if method == 1: d = np.abs(v) + 0.4*w - 60.
+        if method == 2: d = np.abs(v) - 0.139*w + 0.00113*w**2 - 33.1
+        if method == 3: d = w - (50. - 0.7*(v + 5.)**2)
+        return d
+
     def classify(self, w, v, p):
         """ Classify based on velocity, spectral width, and power """
-        if method == 0: self.gs = (np.abs(v) + w/3 < 30).astype(int)
-        if method == 1: self.gs = (np.abs(v) + 0.4*w < 60).astype(int)
-        if method == 2: self.gs = (np.abs(v) - 0.139*w + 0.00113*w**2 < 33.1).astype(int)
-        if method == 3: self.gs = (w - 50-(0.7*(v+5)**2) < 0).astype(int)
-        return
+        self.gs = (self.discriminant(np.asarray(v), np.asarray(w), self.method) < 0).astype(int)
+        return self.gs
+
+def gs_estimation(v, w, methods=[0, 1, 2, 3]):
+    """
+    Batched IS/GS estimation over the flat range gate arrays of a whole interval,
+    all criteria (see SDScatter) are evaluated in one vectorized pass.
+    v: velocity array
+    w: spectral width array
+    methods: list of SDScatter methods
+    Returns GS flags (int8) and GS probabilities 1/(1+exp(d)) (float32), both [len(methods), len(v)]
+    """
+    v, w = np.asarray(v, dtype=np.float32), np.asarray(w, dtype=np.float32)
+    d = np.empty((len(methods), len(v)), dtype=np.float32)
+    for i, m in enumerate(methods):
+        d[i] = SDScatter.discriminant(v, w, m)
+    flags = (d < 0).astype(np.int8)
+    prob = expit(-d, out=d)
+    return flags, prob
 
 def time_days_to_index(time_days):
     """
     Method implemented by Esther Robb to convert datetime to index
-    time_days: List of datetime
+    time_days: datetime64 array or column (or list of datetime)
     """
     return time_sec_to_index(time_days_to_sec(time_days))
 
 def time_sec_to_index(time_sec):
     """
     Method implemented by Esther Robb to convert seconds of a day to index
-    time_sec: List of seconds
+    time_sec: Array of seconds
     """
-    uniq_time = np.sort(np.unique(time_sec))
-    shifted_time = np.roll(uniq_time, -1)       # circular left shift to compute all the time deltas
-    dt = np.min((shifted_time - uniq_time)[:-1])
-    # dt = np.median((shifted_time - uniq_time)[:-1])
-    index_time = time_sec / dt
+    uniq_time = np.unique(time_sec)     # sorted
+    dt = np.min(np.diff(uniq_time)) if len(uniq_time) > 1 else 1.
+    # dt = np.median(np.diff(uniq_time))
+    index_time = np.asarray(time_sec) / dt
     return index_time
 
 def time_days_to_sec(time):
     """
-    Method implemented by Esther Robb to convert datetime to seconds
-    time: List of times
+    Method implemented by Esther Robb to convert datetime to seconds, vectorized on
+    datetime64 and counting total seconds so ranges over several days are continuous
+    time: datetime64 array or column (or list of datetime)
     """
-    time_sec = np.round([(t - time[0]).seconds for t in time])
-    #np.round(np.unique(time_sec).reshape((-1, 1)))
+    t = np.asarray(time, dtype="datetime64[us]")
+    time_sec = np.round((t - t[0]) / np.timedelta64(1, "s")) if len(t) > 0 else np.zeros(0)
     return time_sec
 
+def _boxcox_lambda(x):
+    """
+    Maximum likelihood Box-Cox lambda of one feature (module level to be sent to a worker pool)
+    x: positive values
+    """
+    return float(boxcox_normmax(x, method="mle"))
+
+class BoxCoxTransform(object):
+    """
+    Signed Box-Cox transform of features, sign(x) * boxcox(|x| + shift, lambda).
+    The lambdas are fitted once (on all the rows or on a random sample) and stored, so
+    new data, e.g. scans of a streaming run, is transformed with the same parameters;
+    the shift keeps zeros inside the domain of the transform.
+    """
+
+    def __init__(self, features=["v", "w_l", "p_l"], shift=1., lambdas={}):
+        """
+        Initialize the transform
+        features: features to transform
+        shift: added to |x| before the transform
+        lambdas: fitted lambda of each feature (e.g. from load)
+        """
+        self.features = features
+        self.shift = shift
+        self.lambdas = dict(lambdas)
+        return
+
+    def fit(self, data, sample=None, n_procs=1, random_state=0):
+        """
+        Fit the lambda of each feature, one feature per worker if n_procs > 1
+        data: pandas dataframe (or dict of arrays)
+        sample: number of rows (drawn at random) used for the fit, all rows if None
+        n_procs: number of worker processes
+        """
+        rng = np.random.RandomState(random_state)
+        xs = []
+        for f in self.features:
+            x = np.abs(np.asarray(data[f], dtype=np.float64)) + self.shift
+            x = x[np.isfinite(x)]
+            if (sample is not None) and (len(x) > sample): x = x[rng.choice(len(x), sample, replace=False)]
+            xs.append(x)
+        if n_procs > 1 and len(xs) > 1:
+            with mp.Pool(min(n_procs, len(xs))) as pool:
+                lambdas = pool.map(_boxcox_lambda, xs)
+        else: lambdas = [_boxcox_lambda(x) for x in xs]
+        self.lambdas = dict(zip(self.features, lambdas))
+        return self
+
+    def transform(self, data):
+        """
+        Transform the features in place (the frame is not copied), float32 features stay float32
+        data: pandas dataframe (or dict of arrays)
+        """
+        for f in self.features:
+            x = np.asarray(data[f])
+            dtype = np.result_type(x.dtype, np.float32)
+            y = special.boxcox(np.abs(x).astype(dtype) + dtype.type(self.shift), dtype.type(self.lambdas[f]))
+            data[f] = np.multiply(y, np.sign(x), out=y)
+        return data
+
+    def fit_transform(self, data, sample=None, n_procs=1):
+        """
+        Fit and transform in place
+        """
+        return self.fit(data, sample, n_procs).transform(data)
+
+    def save(self, fname):
+        """
+        Save the fitted parameters to a json file
+        """
+        with open(fname, "w") as fp:
+            json.dump({"features": self.features, "shift": self.shift, "lambdas": self.lambdas}, fp, indent=1)
+        return
+
+    @staticmethod
+    def load(fname):
+        """
+        Load the fitted parameters from a json file
+        """
+        with open(fname, "r") as fp:
+            o = json.load(fp)
+        return BoxCoxTransform(o["features"], o["shift"], o["lambdas"])
+
 def boxcox_tx(data, features=["v", "w_l", "p_l"]):
     """
-    Implement a boxcox transformation
+    Implement a boxcox transformation, float32 features stay float32
     data: Pandas dataframe
     features: all features need a transformations
+    Returns a transformed copy, use BoxCoxTransform to fit once and transform in place
     """
-    _tx = data.copy()
-    for f in features:
-        if f == "v" or f == "w_l": _tx[f] = boxcox(np.abs(_tx[f]))[0] * np.sign(_tx[f])
-        else: _tx[f] = boxcox(np.abs(_tx[f]))[0] * np.sign(_tx[f])
-    return _tx
+    return BoxCoxTransform(features).fit_transform(data.copy())
 
 def get_altitude_azimuth(rad, times, beams, gates):
     """
-    Altitude and azimuth angles of scatter location
+    Altitude and azimuth angles of scatter location, computed for all the echoes
+    at once (see solar.solar_angles)
     rad: Radar code
     times: List of times
     beams: List of beams
     gates: List of gates
     """
-    alt, azm = [], []
-    for t, b, g in zip(times, beams, gates):
-        lat, lon = fetch_scatter_latlon(rad, b, g)
-        alt.append(get_altitude(lat, lon, t))
-        azm.append(get_azimuth(lat, lon, t))
-    return np.array(alt), np.array(azm)
+    zen, azm = solar_angles(rad, times, beams, gates)
+    return 90. - zen, azm
+
+class MinMaxNormalizer(object):
+    """
+    Min-max scaling of a block of features to [a, b]. The running min/max are updated
+    chunk by chunk (partial_fit), so a whole period or a stream is scaled consistently,
+    and can be saved and loaded alongside the model outputs.
+    """
+
+    def __init__(self, features, a=0, b=1, data_min=None, data_max=None):
+        """
+        Initialize the normalizer
+        features: features to normalize
+        a, b: output range
+        data_min, data_max: fitted min and max of each feature (e.g. from load)
+        """
+        self.features = features
+        self.a, self.b = a, b
+        self.data_min = None if data_min is None else np.asarray(data_min, dtype=np.float64)
+        self.data_max = None if data_max is None else np.asarray(data_max, dtype=np.float64)
+        return
+
+    def partial_fit(self, data):
+        """
+        Update the running min/max with one chunk
+        data: pandas dataframe
+        """
+        x = data[self.features].to_numpy(dtype=np.float64)
+        if len(x) == 0: return self
+        lo, hi = np.nanmin(x, axis=0), np.nanmax(x, axis=0)
+        self.data_min = lo if self.data_min is None else np.fmin(self.data_min, lo)
+        self.data_max = hi if self.data_max is None else np.fmax(self.data_max, hi)
+        return self
+
+    def fit(self, data):
+        """
+        Fit the min/max on data
+        """
+        self.data_min, self.data_max = None, None
+        return self.partial_fit(data)
+
+    def transform(self, data):
+        """
+        Normalize the features in place, one block operation per float type (float32
+        features stay float32), features with a constant value are only shifted (as MinMaxScaler)
+        data: pandas dataframe
+        """
+        rng = self.data_max - self.data_min
+        scale = (self.b - self.a) / np.where(rng == 0, 1., rng)
+        groups = {}
+        for i, f in enumerate(self.features):
+            groups.setdefault(np.result_type(data[f].dtype, np.float32), []).append(i)
+        for dtype, idx in groups.items():
+            fs = [self.features[i] for i in idx]
+            x = data[fs].to_numpy(dtype=dtype, copy=True)
+            x -= self.data_min[idx].astype(dtype)
+            x *= scale[idx].astype(dtype)
+            x += dtype.type(self.a)
+            data[fs] = x
+        return data
+
+    def fit_transform(self, data):
+        """
+        Fit and normalize in place
+        """
+        return self.fit(data).transform(data)
+
+    def save(self, fname):
+        """
+        Save the fitted min/max to a json file
+        """
+        with open(fname, "w") as fp:
+            json.dump({"features": self.features, "a": self.a, "b": self.b,
+                "data_min": self.data_min.tolist(), "data_max": self.data_max.tolist()}, fp, indent=1)
+        return
+
+    @staticmethod
+    def load(fname):
+        """
+        Load the fitted min/max from a json file
+        """
+        with open(fname, "r") as fp:
+            o = json.load(fp)
+        return MinMaxNormalizer(o["features"], o["a"], o["b"], o["data_min"], o["data_max"])
 
 def normalize(data, features, a=0, b=1):
     """
-    Normalize the data between a and b
+    Normalize the data between a and b, float32 features stay float32
     data: pandas dataframe
     features: all features need a transformations
     """
-    scaler = MinMaxScaler(feature_range=(a, b))
-    for f in features:
-        data[f] = scaler.fit_transform(np.array(data[f]).reshape(-1, 1)).ravel()
-    return data
+    return MinMaxNormalizer(features, a, b).fit_transform(data)
 
 def kde(probs, labels, pth=0.5, pbnd=[.2,.8]):
     """
@@ -142,19 +328,11 @@ def kde(probs, labels, pth=0.5, pbnd=[.2,.8]):
 
 def get_sza(times, rad, mask=None):
     """
-    Fetch sza at all range cell in radar FoV
+    Fetch sza at all range cell in radar FoV, returned as solar altitude (90 - zenith)
+    [ntime, nbeam, ngate]; grids are memoized per scan time (see solar.solar_grid)
+    times: scan times
     rad: Radar code
     mask: mask metrix
     """
-    fname = "data/sim/{rad}.geolocate.data.nc.gz".format(rad=rad)
-    os.system("gzip -d " + fname)
-    fname = fname.replace(".gz","")
-    data = Dataset(fname)
-    lat, lon = data["geo_lat"], data["geo_lon"]
-    sza = []
-    for d in times:
-        sza.append(get_altitude(lat, lon, d))
-    sza = np.array(sza)
-    os.system("gzip " + fname)
+    sza = np.array([90. - solar_grid(rad, d)[0] for d in times])
     return sza
-